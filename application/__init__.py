@@ -1,32 +1,91 @@
-import pygments, markdown
+import os
+import pygments
 from flask import Flask, flash, redirect, render_template, render_template_string, request, url_for
 from flask_flatpages import FlatPages, pygmented_markdown, pygments_style_defs
 from flask_mail import Mail, Message
-from flask_assets import Environment
 from .forms.paginate import Paginate as Paginate
 from .forms.forms import ContactForm as ContactForm
+from .startup import StartupTimer
+from . import benchmark, bundles, compression, metrics, profiling, render_cache, response_cache
 
 
 def my_markdown(text):
     markdown_text = render_template_string(text)
-    pygmented_text = markdown.markdown(markdown_text, extensions=["codehilite", "fenced_code", "tables", "mdx_math"])
+    pygmented_text = render_cache.cache.render(markdown_text)
     return pygmented_text
 
 
+def markdown_sources(pages):
+    """The template-rendered markdown of every page, as my_markdown passes it to the render cache."""
+    for page in pages:
+        try:
+            yield render_template_string(page.body)
+        except Exception:
+            # pages whose templates need a request are rendered on first view instead
+            continue
+
+
+def init_assets_app():
+    """An app with only the asset bundles, for ``flask assets build`` when the image is built,
+    without the page, cache and Dash setup of init_app or the runtime directories it needs."""
+    app = Flask(__name__, instance_relative_config=False)
+    app.config.from_object("config")
+    bundles.init_app(app)
+    return app
+
+
 def init_app():
+    timer = StartupTimer()
     app = Flask(__name__, instance_relative_config=False)
     app.config.from_object("config")
     app.config["FLATPAGES_HTML_RENDERER"] = my_markdown
+    app.config.setdefault("STARTUP_WARMUP", os.environ.get("STARTUP_WARMUP") == "1")
+    app.config.setdefault("DASH_MOUNT", os.environ.get("DASH_MOUNT", "eager"))
+    render_cache.configure(app.config)
+    response_cache.configure(app.config)
 
-    assets = Environment()
-    assets.init_app(app)
-
+    assets = bundles.init_app(app)
 
     with app.app_context():
-        assets.auto_build = True
-        from . import routes
-        from .plotlydash.dashboard import init_dashboard
+        with timer.phase("imports"):
+            from . import routes
+            from . import freeze, images, mail_spool
+            from .plotlydash import mount
+
+        with timer.phase("asset bundles"):
+            bundles.build_missing(assets)
+
+        images.init_app(app)
+        mail_spool.init_app(app, routes.mail)
+        freeze.init_app(app, routes.pages, routes.post_index, routes.tag_index)
+        compression.init_app(app)
+        metrics.init_app(app)
+        benchmark.init_app(app)
+
+        with timer.phase("flatpages load"):
+            list(routes.pages)
+
+        if app.config.get("MARKDOWN_CACHE_WARM", True):
+            with timer.phase("markdown cache"):
+                render_cache.cache.warm(markdown_sources(routes.pages))
+
+        with timer.phase("search index"):
+            routes.search_index.refresh()
+
+        mount.init_app(app, routes.pages, timer)
+        # around the Dash dispatcher too, so lazily mounted callbacks are profiled
+        profiling.init_app(app)
+
+        if app.config.get("COMPRESS_ASSETS_WARM", True):
+            with timer.phase("precompress assets"):
+                compression.store.build()
 
-        app = init_dashboard(app, routes.pages)
+        # the solvers are only loaded at startup when the Dash app is
+        if app.config["STARTUP_WARMUP"] and app.config["DASH_MOUNT"] == "eager":
+            with timer.phase("simulation warm-up"):
+                from .plotlydash import simulation
+                simulation.warm_up()
 
+    app.extensions["startup_timer"] = timer
+    app.logger.info(timer.report())
     return app
@@ -0,0 +1,280 @@
+"""Benchmarks of the hot paths: the simulation callbacks, internal-state interpolation,
+markdown rendering and the blog routes.
+
+``flask benchmark run`` times every case in this process and writes the timings as JSON;
+``flask benchmark compare`` checks one such file against another and exits non-zero when a
+case got slower than the threshold, so a performance change can be proven, or caught, by
+running the suite before and after it on the same machine.
+
+The callbacks are driven through Dash's HTTP endpoint with the test client, so the timings
+include Dash's dispatch and its JSON encoding of the outputs. Every current is solved once
+before it is timed, so the callback cases measure rendering from the simulation cache; the
+solves themselves are timed as cases of their own."""
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import click
+
+from . import render_cache, response_cache
+
+DASH_UPDATE = '/dashapp/_dash-update-component'
+
+
+class Case:
+    """One timed function; setup, if given, runs untimed before every repeat."""
+
+    def __init__(self, name, run, setup=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+    def time(self, repeat, warmup=1):
+        for _ in range(warmup):
+            self._once()
+        return [self._once() for _ in range(repeat)]
+
+    def _once(self):
+        if self.setup is not None:
+            self.setup()
+        start = time.perf_counter()
+        self.run()
+        return time.perf_counter() - start
+
+
+def summarize(times):
+    return {
+        'repeat': len(times),
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'times': times,
+    }
+
+
+def currents(low, high):
+    """A low and a high current in each direction, within a slider's range."""
+    return [1.0, float(high), -1.0, float(low)]
+
+
+def dash_update(output_ids, inputs, state, changed):
+    """Body of a Dash callback request for outputs given as (id, property) pairs."""
+    outputs = [{'id': id, 'property': prop} for id, prop in output_ids]
+    return {
+        'output': '..' + '...'.join(f'{id}.{prop}' for id, prop in output_ids) + '..',
+        'outputs': outputs,
+        'inputs': [{'id': id, 'property': prop, 'value': value} for id, prop, value in inputs],
+        'state': [{'id': id, 'property': prop, 'value': value} for id, prop, value in state],
+        'changedPropIds': changed,
+    }
+
+
+def post_callback(client, body):
+    response = client.post(DASH_UPDATE, json=body)
+    if response.status_code != 200:
+        raise click.ClickException(f'{body["output"]} returned {response.status_code}')
+
+
+def spm_request(amps):
+    return dash_update([('spm-main-plots', 'children'), ('spm-data-div', 'children')],
+                       [('spm-start-button', 'n_clicks', 1)],
+                       [('spm-current', 'value', amps)],
+                       ['spm-start-button.n_clicks'])
+
+
+def p2d_request(amps):
+    return dash_update([('p2d-main-plots', 'children'), ('p2d-data-div', 'children'),
+                        ('p2d-data-internal-pos-div', 'children'), ('p2d-data-internal-neg-div', 'children'),
+                        ('p2d-job', 'data'), ('p2d-poll', 'disabled'), ('p2d-progress', 'children'),
+                        ('p2d-stream', 'data')],
+                       [('p2d-start-button', 'n_clicks', 1), ('p2d-poll', 'n_intervals', None)],
+                       [('p2d-current', 'value', amps), ('p2d-job', 'data', None)],
+                       ['p2d-start-button.n_clicks'])
+
+
+def interpolation_columns(model):
+    """The internal-state columns a page interpolates: every particle concentration and the potentials."""
+    from .plotlydash.simulation import potential_columns
+    structure = model.internal_structure
+    if 'solid_lithium_concentration' in structure:
+        particles = structure['solid_lithium_concentration']
+        columns = [c for key in particles for c in particles[key]]
+    else:
+        columns = [*structure['positive_concentration'], *structure['negative_concentration']]
+    return columns + list(potential_columns(model))
+
+
+def interpolation_case(name, model_cls, initial_parameters):
+    """Interpolation of every concentration of a 1A discharge onto the decimated time grid a page uses."""
+    from .plotlydash import simulation
+    from .plotlydash.decimation import decimate
+    from .plotlydash.interpolation import linearly_interpolate_concentrations
+    arrays = {}
+
+    def setup():
+        if not arrays:
+            data = simulation.simulate(model_cls, initial_parameters, 1.0)
+            _, state_index = decimate(data.time, data.voltage)
+            columns = interpolation_columns(model_cls(initial_parameters=initial_parameters))
+            arrays.update(time=data.time[state_index], raw_time=data.internal[:, 0],
+                          concentrations=data.internal[:, columns])
+
+    return Case(f'interpolation/{name}', lambda: linearly_interpolate_concentrations(**arrays), setup=setup)
+
+
+def simulation_cases(app, client):
+    if app.config.get('DASH_MOUNT', 'eager') == 'off':
+        click.echo('DASH_MOUNT is off, skipping the simulation cases')
+        return []
+    # builds the Dash app if it is mounted lazily
+    client.get('/dashapp/')
+    from .plotlydash import simulation
+
+    cases = []
+    for name, request in (('SPM', spm_request), ('P2D', p2d_request)):
+        model_cls, initial_parameters = simulation.MODELS[name]
+        for amps in currents(*simulation.CURRENT_RANGES[name]):
+            cases.append(Case(f'solve/{name}/{amps:+.1f}',
+                              lambda m=model_cls, p=initial_parameters, a=amps: simulation.solve(m, p, a)))
+            # solving first puts the result in the simulation cache, so the callback only renders
+            cases.append(Case(f'callback/{name}/{amps:+.1f}', lambda body=request(amps): post_callback(client, body),
+                              setup=lambda m=model_cls, p=initial_parameters, a=amps: simulation.simulate(m, p, a)))
+        cases.append(interpolation_case(name, model_cls, initial_parameters))
+    return cases
+
+
+def markdown_cases(app, pages):
+    from . import my_markdown
+    cold = render_cache.RenderCache(tempfile.mkdtemp(prefix='benchmark-markdown-'))
+
+    def render(body, cache):
+        previous = render_cache.cache
+        render_cache.cache = cache
+        try:
+            # some pages' templates need a request
+            with app.test_request_context():
+                my_markdown(body)
+        finally:
+            render_cache.cache = previous
+
+    def clear():
+        shutil.rmtree(cold.directory, ignore_errors=True)
+
+    cases = []
+    for page in sorted(pages, key=lambda p: p.path):
+        cases.append(Case(f'markdown/{page.path}', lambda b=page.body: render(b, cold), setup=clear))
+        cases.append(Case(f'markdown-cached/{page.path}', lambda b=page.body: render(b, render_cache.cache)))
+    return cases, clear
+
+
+def route_cases(client, pages, tag_index):
+    urls = ['/']
+    urls += [f'/tag/{tag}/' for tag, _ in tag_index.counts()[:3]]
+    urls += [f'/articles/{page.path}/' for page in sorted(pages, key=lambda p: p.path) if 'date' in page.meta]
+
+    def get(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise click.ClickException(f'{url} returned {response.status_code}')
+
+    cases = []
+    for url in urls:
+        cases.append(Case(f'route{url}', lambda u=url: get(u), setup=response_cache.cache.clear))
+        cases.append(Case(f'route-cached{url}', lambda u=url: get(u)))
+    return cases
+
+
+def environment():
+    import numpy
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run(app, repeat=5, warmup=1, match=(), simulation=True):
+    """Time every case whose name contains one of match (all if empty). Returns the results as a dict."""
+    from .routes import pages, tag_index
+    client = app.test_client()
+    with app.app_context():
+        cases, clear_markdown = markdown_cases(app, pages)
+        cases += route_cases(client, pages, tag_index)
+        if simulation:
+            cases += simulation_cases(app, client)
+        cases = [case for case in cases if not match or any(m in case.name for m in match)]
+
+        results = {}
+        try:
+            for case in cases:
+                results[case.name] = summarize(case.time(repeat, warmup))
+                click.echo(f'{case.name:<48} {results[case.name]["median"] * 1000:10.3f} ms')
+        finally:
+            clear_markdown()
+    return {'environment': environment(), 'cases': results}
+
+
+def compare(baseline, current, threshold=0.1, statistic='median'):
+    """Changes of each case in both result sets, as (name, baseline, current, ratio) sorted by ratio."""
+    rows = []
+    for name, result in current['cases'].items():
+        if name in baseline['cases']:
+            before = baseline['cases'][name][statistic]
+            after = result[statistic]
+            rows.append((name, before, after, after / before if before else float('inf')))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    regressions = [row for row in rows if row[3] > 1 + threshold]
+    return rows, regressions
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def init_app(app):
+    """Register the ``flask benchmark`` commands."""
+
+    @app.cli.group('benchmark')
+    def benchmark_group():
+        """Time the simulation callbacks and blog rendering hot paths."""
+
+    @benchmark_group.command('run')
+    @click.option('--output', '-o', default=None, help='Write the results as JSON to this file.')
+    @click.option('--repeat', default=5, show_default=True, help='Timed runs of each case.')
+    @click.option('--warmup', default=1, show_default=True, help='Untimed runs of each case first.')
+    @click.option('--match', '-k', multiple=True, help='Only run cases whose name contains this.')
+    @click.option('--no-simulation', is_flag=True, help='Skip the solver, callback and interpolation cases.')
+    def run_command(output, repeat, warmup, match, no_simulation):
+        """Time every case and print the median of each."""
+        results = run(app, repeat, warmup, match, simulation=not no_simulation)
+        if output:
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+            click.echo(f'wrote {len(results["cases"])} cases to {output}')
+
+    @benchmark_group.command('compare')
+    @click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+    @click.argument('current', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--threshold', default=0.1, show_default=True,
+                  help='Relative slowdown that counts as a regression.')
+    @click.option('--statistic', default='median', show_default=True, type=click.Choice(['min', 'median', 'mean']))
+    def compare_command(baseline, current, threshold, statistic):
+        """Compare two result files, and fail if any case got slower by more than the threshold."""
+        rows, regressions = compare(load(baseline), load(current), threshold, statistic)
+        for name, before, after, ratio in rows:
+            flag = '  REGRESSION' if ratio > 1 + threshold else ''
+            click.echo(f'{name:<48} {before * 1000:10.3f} ms -> {after * 1000:10.3f} ms {ratio:6.2f}x{flag}')
+        if regressions:
+            raise click.ClickException(f'{len(regressions)} of {len(rows)} cases slower by more than {threshold:.0%}')
+        click.echo(f'no regressions in {len(rows)} cases')
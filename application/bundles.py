@@ -0,0 +1,62 @@
+"""Fingerprinted, minified CSS bundles registered on the flask-assets Environment.
+
+The stylesheets are concatenated and minified into ``static/gen/`` under a name carrying
+a hash of their content, so a bundle's URL changes whenever its content does and browsers
+may cache it forever. In production the bundles are built once at deploy time with
+``flask assets build`` and ASSETS_AUTO_BUILD is off; the version of each bundle is then
+read from the manifest that build wrote, not recomputed per request. A bundle that was
+never built is built once at startup instead."""
+import importlib.util
+
+from flask import request
+from flask_assets import Bundle, Environment
+from webassets.exceptions import BundleError
+
+OUTPUT_DIR = 'gen/'
+
+# rcssmin is optional; without it the bundle is only concatenated
+CSS_FILTERS = 'rcssmin' if importlib.util.find_spec('rcssmin') else None
+
+CSS = Bundle(
+    'css/milligram.min.css',
+    'css/style.css',
+    filters=CSS_FILTERS,
+    output=OUTPUT_DIR + 'site.%(version)s.css',
+)
+
+def stylesheet_urls():
+    """URLs of the site stylesheet bundle, for pages not rendered from the blog's templates."""
+    return CSS.urls()
+
+
+def build_missing(assets):
+    """Build every bundle the manifest has no version for, so pages can link it. Returns the number built."""
+    built = 0
+    for bundle in assets:
+        try:
+            bundle.get_version()
+        except BundleError:
+            bundle.build(force=True)
+            built += 1
+    return built
+
+
+def init_app(app):
+    """Create the flask-assets Environment with the bundles, and serve their output with immutable cache headers."""
+    # set before the Environment exists, since it fills in its own defaults for these
+    app.config.setdefault('ASSETS_AUTO_BUILD', app.debug)
+    app.config.setdefault('ASSETS_MANIFEST', 'file')
+    # the version is in the filename, so no ?v= query string
+    app.config.setdefault('ASSETS_URL_EXPIRE', False)
+    assets = Environment(app)
+    assets.register('css_site', CSS)
+
+    output_url = app.static_url_path.rstrip('/') + '/' + OUTPUT_DIR
+
+    @app.after_request
+    def cache_bundles(response):
+        if response.status_code in (200, 304) and request.path.startswith(output_url):
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    return assets
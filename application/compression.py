@@ -0,0 +1,268 @@
+"""Response compression: a precompressed store for static and Dash assets, and on-the-fly
+streaming compression of dynamic responses.
+
+Static files and the Dash component bundles are compressed once (gzip and, if brotli is
+installed, br) into COMPRESSION_CACHE_DIR, keyed by path, size and mtime, and served with
+Content-Encoding negotiation. Dynamic responses such as the Dash callback JSON are
+compressed on the fly when they exceed COMPRESS_MIN_SIZE, chunk by chunk with an
+incremental compressor, so a large body is never held twice and streamed responses stay
+streamed. This replaces the whole-body gzip Dash would otherwise set up with Flask-Compress."""
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, request, send_file
+
+try:
+    from werkzeug.utils import safe_join
+except ImportError:
+    from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# in order of preference
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+EXTENSIONS = {'br': '.br', 'gzip': '.gz'}
+
+ASSET_TYPES = ('.js', '.css', '.svg', '.json', '.txt', '.html')
+
+DYNAMIC_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/css', 'text/plain',
+                     'application/javascript', 'image/svg+xml')
+
+CHUNK_SIZE = 64 * 1024
+
+# brotli's top quality levels take seconds per megabyte, so large bundles use level 9
+LARGE_ASSET = 256 * 1024
+
+
+def negotiate(allowed=ENCODINGS):
+    """The preferred encoding the client accepts, or None."""
+    for encoding in allowed:
+        if encoding in request.accept_encodings:
+            return encoding
+    return None
+
+
+def compress_bytes(data, encoding, level=None):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if level is None else level)
+    return gzip.compress(data, 9 if level is None else level, mtime=0)
+
+
+class StreamCompressor:
+    """Incremental gzip or brotli compressor."""
+
+    def __init__(self, encoding, level=None):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=5 if level is None else level)
+        else:
+            self._compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.process(data) if self.encoding == 'br' else self._compressor.compress(data)
+
+    def flush(self):
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.finish() if self.encoding == 'br' else self._compressor.flush()
+
+
+def compress_chunks(chunks, encoding, flush_each=False, level=None):
+    """Yield the compressed form of an iterable of byte chunks.
+
+    With flush_each every input chunk is flushed through, so each record of a streamed
+    response reaches the client as soon as it is produced."""
+    compressor = StreamCompressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        out = compressor.compress(chunk)
+        if flush_each:
+            out += compressor.flush()
+        if out:
+            yield out
+    yield compressor.finish()
+
+
+def _slices(data, size=CHUNK_SIZE):
+    view = memoryview(data)
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
+
+
+def _compress_file(source, targets):
+    with open(source, 'rb') as f:
+        data = f.read()
+    written = 0
+    for encoding, path in targets:
+        level = 9 if encoding == 'br' and len(data) > LARGE_ASSET else None
+        compressed = compress_bytes(data, encoding, level)
+        if len(compressed) >= len(data):
+            continue
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp, path)
+        written += 1
+    return written
+
+
+class AssetStore:
+    """Precompressed copies of the asset files under directories, stored as ``<sha1 of path, size, mtime>.<gz|br>``."""
+
+    def __init__(self, cache_dir, directories=()):
+        self.cache_dir = cache_dir
+        self.directories = list(directories)
+
+    def path(self, source, encoding):
+        stat = os.stat(source)
+        key = f'{source}:{stat.st_size}:{stat.st_mtime}'
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + EXTENSIONS[encoding])
+
+    def lookup(self, source, encoding):
+        """Path of the precompressed copy of source, or None if there is none."""
+        try:
+            path = self.path(source, encoding)
+        except OSError:
+            return None
+        return path if os.path.exists(path) else None
+
+    def sources(self):
+        for directory in self.directories:
+            for root, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    if filename.endswith(ASSET_TYPES):
+                        yield os.path.join(root, filename)
+
+    def build(self, max_workers=None):
+        """Compress every asset that has no cached copy yet, on a process pool. Returns the count written."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        jobs = {}
+        for source in self.sources():
+            targets = [(encoding, self.path(source, encoding)) for encoding in ENCODINGS]
+            # a missing copy that was too small to shrink is retried; cheap, since such files are small
+            missing = [(e, p) for e, p in targets if not os.path.exists(p)]
+            if missing:
+                jobs[source] = missing
+        if not jobs:
+            return 0
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return sum(pool.map(_compress_file, jobs.keys(), jobs.values()))
+
+
+def dash_package_directories():
+    """Directories of the component packages whose bundles Dash serves."""
+    from dash.development.base_component import ComponentRegistry
+    # the renderer and React bundles ship in dash_renderer, or in dash itself on newer releases
+    for name in sorted(set(ComponentRegistry.registry) | {'dash', 'dash_renderer'}):
+        module = sys.modules.get(name)
+        if module is not None and getattr(module, '__file__', None):
+            yield os.path.dirname(module.__file__)
+
+
+store = None
+
+
+def send_compressed(source, mimetype):
+    """Send the precompressed copy of source the client accepts, or None if there is none."""
+    encoding = negotiate()
+    path = store.lookup(source, encoding) if encoding else None
+    if path is None:
+        return None
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Disposition', None)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress_response(response):
+    """after_request hook compressing large dynamic responses on the fly."""
+    config = current_app.config
+    if (not config.get('COMPRESS_DYNAMIC', True)
+            or response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in DYNAMIC_MIMETYPES):
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, encoding, flush_each=True)
+    else:
+        data = response.get_data()
+        if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+        response.response = compress_chunks(_slices(data), encoding)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    # the compressed body is a different representation, so a strong ETag no longer applies
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    """Serve static files from the precompressed store and compress dynamic responses."""
+    global store
+    store = AssetStore(app.config.get('COMPRESSION_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'precompressed')),
+                       [app.static_folder])
+    static_url = app.static_url_path.rstrip('/') + '/'
+
+    def serve_static():
+        if request.method not in ('GET', 'HEAD') or not request.path.startswith(static_url):
+            return None
+        source = safe_join(app.static_folder, request.path[len(static_url):])
+        if source is None or not os.path.isfile(source):
+            return None
+        return send_compressed(source, mimetypes.guess_type(source)[0])
+
+    app.before_request(serve_static)
+    app.after_request(compress_response)
+    return store
+
+
+def init_dash(server, dash_app):
+    """Serve the Dash bundles from the precompressed store, and compress server's responses if it is not the blog's app."""
+    store.directories.extend(d for d in dash_package_directories() if d not in store.directories)
+    suites_url = dash_app.config.routes_pathname_prefix + '_dash-component-suites/'
+
+    def serve_suites():
+        if request.method not in ('GET', 'HEAD') or not request.path.startswith(suites_url):
+            return None
+        from dash.fingerprint import check_fingerprint
+        package_name, _, fingerprinted = request.path[len(suites_url):].partition('/')
+        path_in_pkg, has_fingerprint = check_fingerprint(fingerprinted)
+        # only what Dash itself would serve; anything else goes on to Dash's own validation
+        if path_in_pkg not in dash_app.registered_paths.get(package_name, ()):
+            return None
+        package = sys.modules.get(package_name)
+        source = safe_join(os.path.dirname(package.__file__), path_in_pkg) if package else None
+        if source is None or not os.path.isfile(source):
+            return None
+        response = send_compressed(source, mimetypes.guess_type(source)[0] or 'application/octet-stream')
+        if response is not None and has_fingerprint:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+        return response
+
+    server.before_request(serve_suites)
+    if compress_response not in server.after_request_funcs.get(None, []):
+        server.after_request(compress_response)
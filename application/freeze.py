@@ -0,0 +1,163 @@
+"""Static export of the blog with Frozen-Flask, and a mode that serves the export directly.
+
+``flask freeze`` writes every article, static page, tag page, index page, pygments.css,
+article image and static file to FREEZER_DESTINATION, with ``.gz`` and ``.br`` siblings
+next to each compressible file. With FROZEN_SERVE enabled, requests are answered from that
+tree (picking the precompressed sibling the client accepts) and only the Dash app, the
+contact form and the API fall through to the dynamic views."""
+import gzip
+import mimetypes
+import os
+import warnings
+
+import click
+from flask import request, send_file
+from flask_frozen import Freezer, MissingURLGeneratorWarning
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# routes that are never frozen, because they need a live request
+DYNAMIC_PREFIXES = ('/dashapp', '/contact', '/api', '/status', '/search', '/metrics')
+
+# formats that are already compressed, so a .gz or .br sibling would not be smaller
+PRECOMPRESSED_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'application/pdf')
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+freezer = Freezer(with_no_argument_rules=False, log_url_for=False)
+
+
+def register_generators(pages, post_index, tag_index):
+    """Tell the freezer which URLs to export for each blog view."""
+
+    @freezer.register_generator
+    def index():
+        yield {}
+
+    @freezer.register_generator
+    def index_extend():
+        for num in range(post_index.get_total_number()):
+            yield {'num': str(num)}
+
+    @freezer.register_generator
+    def pygments_css():
+        yield {}
+
+    @freezer.register_generator
+    def page():
+        for p in post_index.posts:
+            yield {'path': p.path}
+
+    @freezer.register_generator
+    def staticpage():
+        for p in pages:
+            if 'static' in p.meta:
+                yield {'path': p.path}
+
+    @freezer.register_generator
+    def tag():
+        for name, _ in tag_index.counts():
+            yield {'tag': name}
+
+    @freezer.register_generator
+    def serve_static():
+        root = os.path.join(pages.root, 'img')
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(directory, filename), root)
+                yield {'filename': path.replace(os.sep, '/')}
+
+
+def content_type(url_path):
+    """Mimetype of a frozen URL. Trailing-slash URLs are stored as index.html, so guess from the URL."""
+    mimetype, _ = mimetypes.guess_type(url_path.rstrip('/'))
+    return mimetype or 'text/html'
+
+
+def compress_tree(directory, min_size=256):
+    """Write .gz and (if brotli is installed) .br siblings for every compressible file."""
+    count = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith(('.gz', '.br')):
+                continue
+            path = os.path.join(root, filename)
+            url_path = os.path.dirname(path) + '/' if filename == 'index.html' else path
+            if content_type(url_path) in PRECOMPRESSED_TYPES or os.path.getsize(path) < min_size:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data, quality=11)))
+            for ext, compressed in variants:
+                if len(compressed) < len(data):
+                    with open(path + ext, 'wb') as f:
+                        f.write(compressed)
+                    count += 1
+    return count
+
+
+def frozen_file(directory, url_path):
+    """Path of the frozen file for a URL path, or None."""
+    relative = url_path.lstrip('/')
+    if not relative or url_path.endswith('/'):
+        relative += 'index.html'
+    path = os.path.normpath(os.path.join(directory, relative))
+    if not path.startswith(os.path.abspath(directory) + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def serve_frozen(directory):
+    """before_request hook that answers from the frozen tree when a file exists for the URL."""
+    directory = os.path.abspath(directory)
+
+    def hook():
+        if request.method not in ('GET', 'HEAD') or request.path.startswith(DYNAMIC_PREFIXES):
+            return None
+        path = frozen_file(directory, request.path)
+        if path is None:
+            return None
+        mimetype = content_type(request.path)
+        for encoding, ext in ENCODINGS:
+            if encoding in request.accept_encodings and os.path.isfile(path + ext):
+                response = send_file(path + ext, mimetype=mimetype, conditional=True)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_file(path, mimetype=mimetype, conditional=True)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    return hook
+
+
+def init_app(app, pages, post_index, tag_index):
+    """Set up the freezer, the ``flask freeze`` command, and serving from the export if enabled."""
+    app.config.setdefault('FREEZER_DESTINATION', os.path.join(os.path.dirname(app.root_path), 'build'))
+    app.config.setdefault('FREEZER_IGNORE_MIMETYPE_WARNINGS', True)
+    # flask-assets' build cache and manifest live in the static folder but are not for publishing
+    app.config.setdefault('FREEZER_STATIC_IGNORE', ['.webassets-*'])
+    freezer.init_app(app)
+    register_generators(pages, post_index, tag_index)
+
+    @app.cli.command('freeze')
+    @click.option('--output', default=None, help='Export directory. Defaults to FREEZER_DESTINATION.')
+    def freeze_command(output):
+        """Export the blog to static files with precompressed siblings."""
+        if output:
+            app.config['FREEZER_DESTINATION'] = output
+        with warnings.catch_warnings():
+            # the Dash app, contact form and API are deliberately left out
+            warnings.simplefilter('ignore', MissingURLGeneratorWarning)
+            urls = freezer.freeze()
+        click.echo(f'froze {len(urls)} urls to {app.config["FREEZER_DESTINATION"]}')
+        count = compress_tree(app.config['FREEZER_DESTINATION'])
+        click.echo(f'wrote {count} precompressed files')
+
+    if app.config.get('FROZEN_SERVE', False):
+        app.before_request(serve_frozen(app.config['FREEZER_DESTINATION']))
@@ -0,0 +1,151 @@
+"""Resized and WebP variants of the article images, generated once and cached on disk.
+
+``/img/<path>/?w=640`` returns the image scaled down to the nearest configured width, and
+clients that accept image/webp get a WebP encoding. Variants are keyed by the source path,
+its mtime, the width and the format, so they are generated on first request (or up front
+with ``flask build-images``) and reused by every worker afterwards."""
+import hashlib
+import os
+import tempfile
+
+import click
+from flask import current_app, request, send_file
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+RESIZABLE = ('.png', '.jpg', '.jpeg')
+
+WIDTHS = (320, 640, 960, 1280, 1920)
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 82}),
+    'png': ('PNG', 'image/png', {'optimize': True}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def source_format(path):
+    return 'png' if path.lower().endswith('.png') else 'jpeg'
+
+
+def snap_width(width, widths):
+    """The smallest configured width that is at least width, or the largest one."""
+    for w in sorted(widths):
+        if w >= width:
+            return w
+    return max(widths)
+
+
+class ImageVariants:
+    """Generates and caches image variants for the files under root."""
+
+    def __init__(self, root, cache_dir, widths=WIDTHS):
+        self.root = root
+        self.cache_dir = cache_dir
+        self.widths = widths
+
+    def source(self, filename):
+        """Absolute path of a source image, or None if it does not exist under root."""
+        path = os.path.normpath(os.path.join(self.root, filename))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def variant_path(self, source, width, fmt):
+        key = f'{source}:{os.path.getmtime(source)}:{width}:{fmt}'
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.' + fmt)
+
+    def variant(self, source, width=None, fmt=None):
+        """Path of the variant of source at width (None keeps the size) in fmt, generating it if needed."""
+        fmt = fmt or source_format(source)
+        path = self.variant_path(source, width, fmt)
+        if not os.path.exists(path):
+            self._generate(source, path, width, fmt)
+        return path
+
+    def _generate(self, source, path, width, fmt):
+        pil_format, _, options = FORMATS[fmt]
+        with Image.open(source) as image:
+            image.load()
+            if width is not None and image.width > width:
+                height = round(image.height * width / image.width)
+                image = image.resize((width, height), Image.LANCZOS)
+            if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, pil_format, **options)
+        os.replace(tmp, path)
+
+    def sources(self):
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.lower().endswith(RESIZABLE):
+                    yield os.path.join(directory, filename)
+
+
+variants = None
+
+
+def configure(app):
+    global variants
+    root = os.path.join(app.root_path, 'pages', 'img')
+    cache_dir = app.config.get('IMAGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'blog-images'))
+    variants = ImageVariants(root, cache_dir, app.config.get('IMAGE_WIDTHS', WIDTHS))
+    return variants
+
+
+def requested_width():
+    try:
+        width = int(request.args.get('w', ''))
+    except ValueError:
+        return None
+    return snap_width(width, variants.widths) if width > 0 else None
+
+
+def accepts_webp():
+    # match image/webp explicitly, since */* would also accept it
+    return 'image/webp' in request.accept_mimetypes.values()
+
+
+def serve(filename):
+    """Response for an article image, choosing the variant from the w parameter and Accept header."""
+    source = variants.source(filename)
+    if source is None:
+        return None
+    if Image is not None and source.lower().endswith(RESIZABLE):
+        width = requested_width()
+        fmt = 'webp' if accepts_webp() else source_format(source)
+        if width is None and fmt == source_format(source):
+            response = send_file(source, conditional=True)
+        else:
+            response = send_file(variants.variant(source, width, fmt), mimetype=FORMATS[fmt][1], conditional=True)
+        response.vary.add('Accept')
+    else:
+        response = send_file(source, conditional=True)
+    # the ETag follows the file, so an edited image still revalidates once the max-age runs out
+    max_age = current_app.config.get('IMAGE_MAX_AGE', 31536000)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    return response
+
+
+def init_app(app):
+    """Configure the variant cache and register the ``flask build-images`` command."""
+    configure(app)
+
+    @app.cli.command('build-images')
+    def build_images_command():
+        """Generate every width and format variant of the article images."""
+        if Image is None:
+            raise click.ClickException('Pillow is not installed')
+        count = 0
+        for source in variants.sources():
+            for fmt in ('webp', source_format(source)):
+                for width in (None, *variants.widths):
+                    variants.variant(source, width, fmt)
+                    count += 1
+        click.echo(f'{count} image variants in {variants.cache_dir}')
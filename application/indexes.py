@@ -0,0 +1,140 @@
+"""Article indexes built once from FlatPages and rebuilt only when FlatPages reloads its files.
+
+FlatPages keeps its loaded pages in a dict that it replaces on every reload (including the
+auto-reload in debug mode), so comparing that dict's identity is enough to notice a reload."""
+import hashlib
+import threading
+import time
+
+
+def by_date(pages):
+    """Pages sorted newest first; pages without a date go last."""
+    dated = [p for p in pages if "date" in p.meta]
+    undated = [p for p in pages if "date" not in p.meta]
+    return sorted(dated, reverse=True, key=lambda page: page.meta["date"]) + undated
+
+
+def page_tags(page):
+    tags = page.meta.get("tags") or []
+    return [tags] if isinstance(tags, str) else tags
+
+
+class FlatPagesIndex:
+    """Base for indexes that are rebuilt from the FlatPages page dict whenever it is replaced."""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self._source = None
+        self._lock = threading.Lock()
+
+    def _build(self, source):
+        raise NotImplementedError
+
+    def refresh(self):
+        """Rebuild the index if FlatPages has loaded a new set of pages since the last build."""
+        source = self.pages._pages
+        if source is not self._source:
+            with self._lock:
+                if source is not self._source:
+                    self._build(source)
+                    self._source = source
+        return self
+
+
+class PostIndex(FlatPagesIndex):
+    """Dated articles sorted newest first, sliced into pages of a fixed size."""
+
+    def __init__(self, pages, per_page):
+        super().__init__(pages)
+        self.per_page = per_page
+        self._posts = []
+
+    def _build(self, source):
+        self._posts = by_date([p for p in source.values() if "date" in p.meta])
+
+    @property
+    def posts(self):
+        return self.refresh()._posts
+
+    def get_total_number(self):
+        return -(-len(self.posts) // self.per_page)
+
+    def get_number_pages(self, num):
+        start = num * self.per_page
+        return self.posts[start:start + self.per_page]
+
+
+class TagIndex(FlatPagesIndex):
+    """Inverted index from each tag to its pages, sorted newest first, with per-tag counts."""
+
+    def __init__(self, pages):
+        super().__init__(pages)
+        self._tags = {}
+        self._counts = {}
+
+    def _build(self, source):
+        tagged = {}
+        for page in source.values():
+            for tag in page_tags(page):
+                tagged.setdefault(tag, []).append(page)
+        self._tags = {tag: by_date(pages) for tag, pages in tagged.items()}
+        self._counts = {tag: len(pages) for tag, pages in self._tags.items()}
+
+    def get(self, tag):
+        return self.refresh()._tags.get(tag, [])
+
+    def count(self, tag):
+        return self.refresh()._counts.get(tag, 0)
+
+    def counts(self):
+        """Tag counts, most used first."""
+        counts = self.refresh()._counts
+        return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def intersection(self, tags):
+        """Pages carrying every one of tags, sorted newest first."""
+        tags = list(tags)
+        if not tags:
+            return []
+        # walk the rarest tag's list and keep the pages every other tag also has
+        tags.sort(key=self.count)
+        others = [set(id(p) for p in self.get(tag)) for tag in tags[1:]]
+        return [p for p in self.get(tags[0]) if all(id(p) in other for other in others)]
+
+    def cloud(self, steps=5):
+        """(tag, count, weight) for every tag, alphabetically, with weight from 1 to steps by count."""
+        counts = self.refresh()._counts
+        if not counts:
+            return []
+        low, high = min(counts.values()), max(counts.values())
+        spread = max(high - low, 1)
+        return [(tag, count, 1 + round((count - low) * (steps - 1) / spread)) for tag, count in sorted(counts.items())]
+
+
+class PageVersions(FlatPagesIndex):
+    """File modification time of every page and a version hash over all of them, for HTTP validators."""
+
+    def __init__(self, pages):
+        super().__init__(pages)
+        self._mtimes = {}
+        self._version = None
+        self._last_modified = None
+
+    def _build(self, source):
+        # FlatPages remembers the mtime it loaded each file at, keyed by filename
+        loaded = {id(page): mtime for page, mtime in getattr(self.pages, "_file_cache", {}).values()}
+        now = time.time()
+        self._mtimes = {path: loaded.get(id(page), now) for path, page in source.items()}
+        self._version = hashlib.sha1(repr(sorted(self._mtimes.items())).encode()).hexdigest()
+        self._last_modified = max(self._mtimes.values(), default=now)
+
+    def mtime(self, path):
+        return self.refresh()._mtimes.get(path)
+
+    @property
+    def version(self):
+        return self.refresh()._version
+
+    @property
+    def last_modified(self):
+        return self.refresh()._last_modified
@@ -0,0 +1,234 @@
+"""Outbound mail spooled to disk and sent by a background thread.
+
+The contact form only writes its message to the spool and returns; a sender thread in each
+worker picks messages up in batches and sends them over one SMTP connection, which it keeps
+open while there is more to send. A message that fails is retried with exponential backoff
+and moved to ``failed/`` after MAIL_SPOOL_MAX_ATTEMPTS.
+
+The spool is a directory so that every gunicorn worker shares it and nothing is lost on a
+restart: ``new/`` holds messages waiting to be sent, ``<name>.json`` each, and a sender claims
+one by renaming it into ``sending/``, which only one worker can do. A claim left behind by
+a worker that died is returned to ``new/`` after MAIL_SPOOL_CLAIM_TIMEOUT."""
+import json
+import logging
+import os
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+import click
+from flask_mail import Message
+
+logger = logging.getLogger(__name__)
+
+NEW = 'new'
+SENDING = 'sending'
+FAILED = 'failed'
+
+FIELDS = ('subject', 'sender', 'recipients', 'body', 'html', 'reply_to', 'cc', 'bcc')
+
+# errors from the mail server or the network, which are worth retrying
+TRANSIENT_ERRORS = (smtplib.SMTPException, socket.error)
+
+
+def to_record(message):
+    record = {field: getattr(message, field) for field in FIELDS}
+    record['attempts'] = 0
+    record['next_attempt'] = 0
+    return record
+
+
+def to_message(record):
+    return Message(**{field: record.get(field) for field in FIELDS})
+
+
+class MailSpool:
+    """Spool directory of outbound messages, and the thread that sends them."""
+
+    def __init__(self, app, mail, directory, batch_size=20, max_attempts=8, backoff=30, max_backoff=3600,
+                 claim_timeout=600, poll=30):
+        self.app = app
+        self.mail = mail
+        self.directory = directory
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.claim_timeout = claim_timeout
+        self.poll = poll
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        for name in (NEW, SENDING, FAILED):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _path(self, state, name):
+        return os.path.join(self.directory, state, name)
+
+    def _write(self, state, name, record):
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.directory, state), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp, self._path(state, name))
+
+    def enqueue(self, message):
+        """Write message to the spool and wake the sender. Returns the spooled file's name."""
+        # names sort in the order messages were spooled
+        name = f'{time.time():.6f}-{uuid.uuid4().hex}.json'
+        self._write(NEW, name, to_record(message))
+        self.start()
+        self._wake.set()
+        return name
+
+    def pending(self):
+        return sorted(n for n in os.listdir(os.path.join(self.directory, NEW)) if n.endswith('.json'))
+
+    def _recover(self):
+        """Return claims older than claim_timeout to new/, for messages whose sender died."""
+        cutoff = time.time() - self.claim_timeout
+        for name in os.listdir(os.path.join(self.directory, SENDING)):
+            path = self._path(SENDING, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.rename(path, self._path(NEW, name.rsplit('.', 1)[0]))
+            except OSError:
+                continue
+
+    def claim(self, limit):
+        """Claim up to limit messages that are due, as (claimed path, name, record) tuples."""
+        now = time.time()
+        claimed = []
+        for name in self.pending():
+            if len(claimed) >= limit:
+                break
+            try:
+                with open(self._path(NEW, name)) as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if record.get('next_attempt', 0) > now:
+                continue
+            claimed_path = self._path(SENDING, f'{name}.{os.getpid()}')
+            try:
+                os.rename(self._path(NEW, name), claimed_path)
+            except OSError:
+                # another worker claimed it first
+                continue
+            # the rename keeps the old mtime, which _recover would take for a stale claim
+            os.utime(claimed_path)
+            claimed.append((claimed_path, name, record))
+        return claimed
+
+    def _sent(self, claimed_path):
+        os.remove(claimed_path)
+
+    def _failed(self, claimed_path, name, record, error, permanent=False):
+        record['attempts'] += 1
+        record['error'] = str(error) or type(error).__name__
+        if permanent or record['attempts'] >= self.max_attempts:
+            logger.error('giving up on mail %s after %d attempts: %s', name, record['attempts'], error)
+            self._write(FAILED, name, record)
+        else:
+            delay = min(self.backoff * 2 ** (record['attempts'] - 1), self.max_backoff)
+            record['next_attempt'] = time.time() + delay
+            logger.warning('mail %s failed (%s), retrying in %ds', name, error, delay)
+            self._write(NEW, name, record)
+        os.remove(claimed_path)
+
+    def send_pending(self):
+        """Send every message that is due, in batches over one connection. Returns (sent, failed)."""
+        sent = failed = 0
+        self._recover()
+        claimed = self.claim(self.batch_size)
+        if not claimed:
+            return sent, failed
+        with self.app.app_context():
+            try:
+                with self.mail.connect() as connection:
+                    while claimed:
+                        claim = claimed.pop(0)
+                        try:
+                            connection.send(to_message(claim[2]))
+                        except (smtplib.SMTPServerDisconnected, socket.error):
+                            # the connection is gone, so this message and the rest of the batch are retried later
+                            claimed.insert(0, claim)
+                            raise
+                        except smtplib.SMTPException as e:
+                            self._failed(*claim, e)
+                            failed += 1
+                        except Exception as e:
+                            # a message that cannot be built or sent, e.g. one without a sender, never will be
+                            logger.exception('mail %s cannot be sent', claim[1])
+                            self._failed(*claim, e, permanent=True)
+                            failed += 1
+                        else:
+                            self._sent(claim[0])
+                            sent += 1
+                        if not claimed:
+                            claimed = self.claim(self.batch_size)
+            except TRANSIENT_ERRORS as e:
+                # could not connect, or lost the connection part way through a batch
+                for claim in claimed:
+                    self._failed(*claim, e)
+                    failed += 1
+            except Exception as e:
+                # anything else from the connection itself, e.g. a bad mail config, is retried too
+                logger.exception('mail connection failed')
+                for claim in claimed:
+                    self._failed(*claim, e)
+                    failed += 1
+        return sent, failed
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll)
+            self._wake.clear()
+            try:
+                self.send_pending()
+            except Exception:
+                logger.exception('mail spool sender failed')
+
+    def start(self):
+        """Start the sender thread in this process, if it is not running yet.
+
+        Threads do not survive a fork, so this checks the pid and starts one per gunicorn worker."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='mail-spool', daemon=True)
+                self._thread.start()
+                # pick up whatever an earlier process left in the spool
+                self._wake.set()
+
+
+spool = None
+
+
+def init_app(app, mail):
+    """Open the spool in MAIL_SPOOL_DIR and register the ``flask send-mail`` command."""
+    global spool
+    config = app.config
+    spool = MailSpool(
+        app, mail,
+        config.get('MAIL_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'mail-spool')),
+        batch_size=config.get('MAIL_SPOOL_BATCH_SIZE', 20),
+        max_attempts=config.get('MAIL_SPOOL_MAX_ATTEMPTS', 8),
+        backoff=config.get('MAIL_SPOOL_BACKOFF', 30),
+        max_backoff=config.get('MAIL_SPOOL_MAX_BACKOFF', 3600),
+        claim_timeout=config.get('MAIL_SPOOL_CLAIM_TIMEOUT', 600),
+        poll=config.get('MAIL_SPOOL_POLL', 30),
+    )
+
+    @app.cli.command('send-mail')
+    def send_mail_command():
+        """Send every spooled message that is due, in this process."""
+        sent, failed = spool.send_pending()
+        click.echo(f'sent {sent}, failed {failed}, {len(spool.pending())} left in {spool.directory}')
+
+    return spool
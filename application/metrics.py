@@ -0,0 +1,128 @@
+"""Latency histograms for every route, every Dash callback and each phase of a simulation, served
+at /metrics in the Prometheus text format.
+
+Under gunicorn every worker, and every process of the simulation pools, records into its own
+files in PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py sets it), and /metrics adds them all up,
+so a scrape sees the whole server whichever worker answers it. Without that variable the
+metrics are kept in memory for the one process. prometheus_client is optional; without it
+nothing is recorded and /metrics is a 404."""
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import Response, abort, g, request
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:
+    Histogram = None
+
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+
+if Histogram is not None:
+    REQUEST_SECONDS = Histogram('flask_request_duration_seconds', 'Time to handle a request, by route.',
+                                ['method', 'endpoint', 'status'], buckets=BUCKETS)
+    CALLBACK_SECONDS = Histogram('dash_callback_duration_seconds', 'Time to run a Dash callback and encode its output.',
+                                 ['callback'], buckets=BUCKETS)
+    PHASE_SECONDS = Histogram('simulation_phase_duration_seconds', 'Time spent in each phase of a simulation.',
+                              ['model', 'phase'], buckets=BUCKETS)
+
+_local = threading.local()
+
+
+def multiprocess_dir():
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir')
+
+
+def observe_phase(model, phase, seconds):
+    if Histogram is not None:
+        PHASE_SECONDS.labels(model, phase).observe(seconds)
+
+
+class Laps:
+    """Times consecutive phases of one simulation: each lap() records the time since the previous one.
+
+    The most recent Laps of a thread is remembered, so the Dash callback around it can record
+    the time after the last lap, when Dash encodes the callback's output, as serialization."""
+
+    def __init__(self, model):
+        self.model = model
+        self.last = time.perf_counter()
+        _local.laps = self
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        observe_phase(self.model, phase, now - self.last)
+        self.last = now
+
+
+def timed_callback(callback_id, callback):
+    @wraps(callback)
+    def wrapper(*args, **kwargs):
+        _local.laps = None
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            CALLBACK_SECONDS.labels(callback_id).observe(end - start)
+            laps = _local.laps
+            if laps is not None:
+                # after the callback's last lap: transport.dumps and Dash's own JSON encoding of the outputs
+                observe_phase(laps.model, 'serialization', end - laps.last)
+                _local.laps = None
+    return wrapper
+
+
+def instrument_requests(app):
+    """Time every request to app."""
+    if Histogram is None or 'metrics' in app.extensions:
+        return
+    app.extensions['metrics'] = True
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            # for a streamed response this is the time until streaming starts
+            REQUEST_SECONDS.labels(request.method, request.endpoint or 'unmatched',
+                                   response.status_code).observe(time.perf_counter() - start)
+        return response
+
+
+def instrument_dash(dash_app):
+    """Time every server-side callback registered on dash_app so far, and the requests to its server."""
+    if Histogram is None:
+        return
+    instrument_requests(dash_app.server)
+    for callback_id, entry in dash_app.callback_map.items():
+        if 'callback' in entry and not getattr(entry['callback'], '_timed', False):
+            entry['callback'] = timed_callback(callback_id, entry['callback'])
+            entry['callback']._timed = True
+
+
+def render():
+    """The current metrics in the Prometheus text format, summed over every process if multiprocess."""
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def init_app(app):
+    """Time every request to app, and serve /metrics on it."""
+    instrument_requests(app)
+
+    @app.route('/metrics')
+    def metrics():
+        if Histogram is None or not app.config.get('METRICS_ENABLED', True):
+            abort(404)
+        return Response(render(), content_type=CONTENT_TYPE_LATEST)
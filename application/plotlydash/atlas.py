@@ -0,0 +1,141 @@
+"""Precomputed current-sweep atlas of simulation results, stored as a memory-mapped file.
+
+Each model gets two files in the atlas directory: ``<name>.bin``, a flat little-endian
+float64 array holding every result back to back, and ``<name>.json``, an index of the
+offset and shape of each array keyed by current. Results are served as read-only views
+into the mapping, so every gunicorn worker shares the same page cache."""
+import json
+import os
+
+import click
+import numpy as np
+from ampere.base_battery import ChargeResult
+
+DTYPE = np.dtype('<f8')
+FIELDS = ChargeResult._fields
+
+
+def current_key(amps):
+    return f'{amps:.1f}'
+
+
+def sweep_currents(low, high, step=0.1):
+    """Every distinct normalized current a slider from low to high can produce."""
+    from .simulation import normalize_current
+    n = int(round((high - low) / step))
+    currents = {normalize_current(round(low + i * step, 1)) for i in range(n + 1)}
+    currents.discard(0)
+    return sorted(currents)
+
+
+class Atlas:
+    """Read-only lookup into a built atlas."""
+
+    def __init__(self, directory, name):
+        with open(os.path.join(directory, f'{name}.json')) as f:
+            index = json.load(f)
+        self.name = name
+        self.model = index['model']
+        self.initial_parameters = index['initial_parameters']
+        self.entries = index['entries']
+        data_path = os.path.join(directory, f'{name}.bin')
+        if os.path.getsize(data_path):
+            self._data = np.memmap(data_path, dtype=DTYPE, mode='r')
+        else:
+            self._data = np.empty(0, dtype=DTYPE)
+
+    def __contains__(self, amps):
+        return current_key(amps) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def matches(self, model_cls, initial_parameters):
+        return self.model == model_cls.__name__ and self.initial_parameters == (initial_parameters or {})
+
+    def get(self, amps):
+        entry = self.entries.get(current_key(amps))
+        if entry is None:
+            return None
+        arrays = []
+        for field in FIELDS:
+            if entry[field] is None:
+                arrays.append(None)
+                continue
+            offset, shape = entry[field]
+            size = int(np.prod(shape))
+            arrays.append(self._data[offset:offset + size].reshape(shape))
+        return ChargeResult(*arrays)
+
+
+def build_atlas(directory, name, model_cls, initial_parameters, currents, solve):
+    """Solve every current and write the results to ``<directory>/<name>.bin``.
+
+    Both files are written to temporaries and swapped in at the end, so an interrupted
+    build leaves the previous atlas in place."""
+    os.makedirs(directory, exist_ok=True)
+    entries = {}
+    failed = []
+    offset = 0
+    data_path = os.path.join(directory, f'{name}.bin')
+    with open(data_path + '.tmp', 'wb') as f:
+        for amps in currents:
+            try:
+                result = solve(model_cls, initial_parameters, amps)
+            except Exception:
+                failed.append(amps)
+                continue
+            entry = {}
+            for field, value in zip(FIELDS, result):
+                if value is None:
+                    entry[field] = None
+                    continue
+                value = np.ascontiguousarray(value, dtype=DTYPE)
+                f.write(value.tobytes())
+                entry[field] = [offset, list(value.shape)]
+                offset += value.size
+            entries[current_key(amps)] = entry
+    os.replace(data_path + '.tmp', data_path)
+
+    index = {
+        'model': model_cls.__name__,
+        'initial_parameters': initial_parameters or {},
+        'entries': entries,
+    }
+    index_path = os.path.join(directory, f'{name}.json')
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(index_path + '.tmp', index_path)
+    return len(entries), failed
+
+
+def load_atlases(directory):
+    """Open every atlas found in directory, keyed by name."""
+    atlases = {}
+    if not os.path.isdir(directory):
+        return atlases
+    for filename in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(filename)
+        if ext == '.json' and os.path.exists(os.path.join(directory, f'{name}.bin')):
+            atlases[name] = Atlas(directory, name)
+    return atlases
+
+
+def init_app(server):
+    """Register the ``flask build-atlas`` command."""
+
+    @server.cli.command('build-atlas')
+    @click.option('--model', 'models', multiple=True, help='Model name to sweep, e.g. SPM or P2D. Defaults to all.')
+    @click.option('--output', default=None, help='Atlas directory. Defaults to SIMULATION_ATLAS_DIR.')
+    def build_atlas_command(models, output):
+        """Sweep every slider current and write the simulation atlas."""
+        from .simulation import MODELS, CURRENT_RANGES, solve
+        directory = output or server.config['SIMULATION_ATLAS_DIR']
+        for name in models or CURRENT_RANGES:
+            model_cls, initial_parameters = MODELS[name]
+            currents = sweep_currents(*CURRENT_RANGES[name])
+            click.echo(f'{name}: solving {len(currents)} currents')
+            count, failed = build_atlas(directory, name, model_cls, initial_parameters, currents, solve)
+            click.echo(f'{name}: wrote {count} results to {directory}')
+            if failed:
+                click.echo(f'{name}: failed to solve at {failed}')
@@ -0,0 +1,132 @@
+"""Batches of simulations for the /api/simulate endpoint, solved in parallel as background jobs.
+
+Currents already in an atlas or the cache are answered immediately; the rest are submitted
+to the job queue like the pages' solves, so they share its pending bound, timeouts and
+solver processes, and are reported in the order they finish, not the order they were
+requested. At most SIMULATION_BATCH_MAX_PENDING of a batch's solves are queued at once,
+so a large batch leaves room in the queue for the pages."""
+import time
+
+import numpy as np
+from flask import current_app
+
+from . import jobs, simulation
+
+# most currents one request may ask for; a P2D solve takes seconds, and the whole batch
+# has to finish within the gunicorn timeout
+MAX_CURRENTS = {'SPM': 64, 'SPM-SEI': 64, 'P2D': 8}
+
+# seconds between checks of a batch's pending jobs
+POLL_INTERVAL = 0.1
+
+
+class BatchError(ValueError):
+    """Raised for a batch request that cannot be run, with a message for the client."""
+
+
+def parse_request(body):
+    """Validate a request body and return (model name, normalized currents, internal)."""
+    if not isinstance(body, dict):
+        raise BatchError('expected a JSON object')
+    name = body.get('model', 'SPM')
+    if name not in simulation.MODELS:
+        raise BatchError(f'unknown model {name!r}, expected one of {", ".join(simulation.MODELS)}')
+    currents = body.get('currents')
+    if not isinstance(currents, list) or not currents:
+        raise BatchError('currents must be a non-empty list of numbers')
+    max_currents = current_app.config.get('SIMULATION_BATCH_MAX_CURRENTS', MAX_CURRENTS)[name]
+    if len(currents) > max_currents:
+        raise BatchError(f'at most {max_currents} {name} currents per request')
+    max_amps = current_app.config.get('SIMULATION_BATCH_MAX_AMPS', 10)
+    normalized = []
+    for amps in currents:
+        if isinstance(amps, bool) or not isinstance(amps, (int, float)) or not abs(amps) <= max_amps:
+            raise BatchError(f'currents must be numbers between {-max_amps} and {max_amps}, got {amps!r}')
+        amps = simulation.normalize_current(amps)
+        if amps not in normalized:
+            normalized.append(amps)
+    return name, normalized, bool(body.get('internal', False))
+
+
+def capacity(time, current):
+    """Cumulative capacity in amp-hours passed by the end of each time step."""
+    current = np.abs(current)
+    charge = np.cumsum(np.diff(time) * (current[1:] + current[:-1]) / 2)
+    return np.concatenate(([0], charge)) / 3600
+
+
+def _internal_states(structure, internal):
+    states = {}
+    for key, columns in structure.items():
+        if isinstance(columns, dict):
+            states[key] = _internal_states(columns, internal)
+        else:
+            states[key] = internal[:, columns].tolist()
+    return states
+
+
+def record(name, amps, result, internal=False):
+    """The JSON-able record of one solved current."""
+    out = {
+        'model': name,
+        'current': amps,
+        'time': result.time.tolist(),
+        'voltage': result.voltage.tolist(),
+        'capacity': capacity(result.time, result.current).tolist(),
+    }
+    if internal:
+        model_cls, initial_parameters = simulation.MODELS[name]
+        structure = model_cls(initial_parameters=initial_parameters).internal_structure
+        out['internal'] = _internal_states(structure, result.internal)
+    return out
+
+
+def run(name, currents, internal=False):
+    """Submit the first solves of a batch, and return a generator of one record per current.
+
+    Raises jobs.QueueFull, before anything is sent, if the queue has no room for the first solve."""
+    model_cls, initial_parameters = simulation.MODELS[name]
+    cached = []
+    remaining = []
+    for amps in currents:
+        result = simulation.cached_result(model_cls, initial_parameters, amps)
+        if result is not None:
+            cached.append((amps, result))
+        else:
+            remaining.append(amps)
+    max_pending = current_app.config.get('SIMULATION_BATCH_MAX_PENDING', max(1, jobs.queue.max_pending // 2))
+    pending = {}
+
+    def fill():
+        while remaining and len(pending) < max_pending:
+            pending[simulation.submit_simulation(model_cls, initial_parameters, remaining[0])] = remaining[0]
+            remaining.pop(0)
+
+    try:
+        fill()
+    except jobs.QueueFull:
+        if not pending:
+            raise
+
+    def results():
+        for amps, result in cached:
+            yield record(name, amps, result, internal)
+        # if the client goes away, the rest of the batch is never submitted
+        while pending:
+            time.sleep(POLL_INTERVAL)
+            for job_id, amps in list(pending.items()):
+                status = jobs.queue.status(job_id)
+                if status is not None and status['state'] == jobs.QUEUED:
+                    continue
+                del pending[job_id]
+                if status is not None and status['state'] == jobs.DONE:
+                    yield record(name, amps, jobs.queue.result(job_id), internal)
+                else:
+                    yield {'model': name, 'current': amps, 'error': status['error'] if status else 'job not found'}
+            try:
+                fill()
+            except jobs.QueueFull:
+                # wait for the pages' jobs, or this batch's, to make room
+                pass
+
+    return results()
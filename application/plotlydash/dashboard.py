@@ -1,4 +1,7 @@
 """Instantiate a Dash application."""
+import os
+import tempfile
+
 import numpy as np
 import pandas as pd
 
@@ -18,7 +21,15 @@ base = '/dashapp'
 def init_dashboard(server, pages):
     """Create a Plotly Dash dashboard."""
     from .pages.app_base import init_app
+    from . import atlas, jobs, simulation
+    from .. import compression, metrics
+    server.config.setdefault('SIMULATION_ATLAS_DIR', os.path.join(os.path.dirname(server.root_path), 'simulation_atlas'))
+    server.config.setdefault('SIMULATION_JOB_DIR', os.path.join(tempfile.gettempdir(), 'dashapp-jobs'))
+    simulation.configure(server.config)
+    jobs.configure(server.config)
+    atlas.init_app(server)
     dash_app = init_app(server)
+    compression.init_dash(server, dash_app)
     spm_layout = single_particle_page(dash_app)
     p2d_layout = p2d_page(dash_app)
 
@@ -65,11 +76,12 @@ def init_dashboard(server, pages):
     @dash_app.callback(Output('page-content', 'children'),
                        [Input('url', 'pathname')])
     def display_page(pathname):
-        print(pathname)
         if pathname == f'{base}/single-particle':
             return spm_layout
         elif pathname == f'{base}/pseudo-two-dim':
             return p2d_layout
         else:
             return index_page
+
+    metrics.instrument_dash(dash_app)
     return dash_app.server
@@ -0,0 +1,61 @@
+"""Server-side decimation of simulation traces before they are sent to the browser.
+
+The voltage curve is reduced with Largest-Triangle-Three-Buckets, which keeps its visual
+shape. The internal states share one scrubbing grid picked by adaptive resampling, which
+spends more of the point budget on the fast transients at the start of a run."""
+import numpy as np
+from flask import current_app
+
+
+def lttb(x, y, n_out):
+    """Indices of the n_out points of (x, y) chosen by Largest-Triangle-Three-Buckets."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start = edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+        # twice the area of the triangle formed with the last kept point and the next bucket's average
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def _normalized_arc(values):
+    steps = np.abs(np.diff(values))
+    total = steps.sum()
+    if not np.isfinite(total) or total == 0:
+        return np.zeros(len(values))
+    return np.concatenate(([0], np.cumsum(steps) / total))
+
+
+def adaptive_indices(x, y, n_out):
+    """Indices of at most n_out points spaced evenly in a combined measure of elapsed time,
+    log-time and change in y, so early transients get proportionally more samples."""
+    n = len(x)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    elapsed = x - x[0]
+    log_time = np.log1p(1000 * elapsed / elapsed[-1]) if elapsed[-1] > 0 else elapsed
+    measure = (_normalized_arc(x) + _normalized_arc(log_time) + _normalized_arc(np.nan_to_num(y))) / 3
+    indices = np.searchsorted(measure, np.linspace(0, measure[-1], n_out))
+    indices = np.unique(np.clip(indices, 0, n - 1))
+    indices[0], indices[-1] = 0, n - 1
+    return np.unique(indices)
+
+
+def decimate(time, voltage, voltage_points=None, state_points=None):
+    """Return (voltage indices, state indices) into time for the configured point budgets."""
+    if voltage_points is None:
+        voltage_points = current_app.config.get('SIMULATION_VOLTAGE_POINTS', 300)
+    if state_points is None:
+        state_points = current_app.config.get('SIMULATION_STATE_POINTS', 150)
+    return lttb(time, voltage, voltage_points), adaptive_indices(time, voltage, state_points)
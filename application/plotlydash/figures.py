@@ -0,0 +1,117 @@
+"""Plain-dict figure builders shared by the simulation pages.
+
+dcc.Graph accepts figures as plain dicts, so the pages skip plotly's validating
+go.Figure / make_subplots constructors. The layout templates and colorscales are
+built once here instead of on every callback."""
+from functools import lru_cache
+
+import plotly.io as pio
+from colour import Color
+
+LIGHT_GREEN = 'rgb(33, 209, 59)'
+DARK_GREEN = 'darkgreen'
+GREY = 'darkgrey'
+
+LEGEND_FONT = {'family': 'sans-serif', 'size': 12, 'color': 'black'}
+
+# the default plotly template, which go.Figure would otherwise attach to every figure
+TEMPLATE = pio.templates[pio.templates.default].to_plotly_json()
+
+BASE_LAYOUT = {
+    'template': TEMPLATE,
+    'paper_bgcolor': 'rgb(240, 240, 240)',
+    'plot_bgcolor': 'rgb(220, 220, 220)',
+    'height': 350,
+}
+
+WIDE_MARGIN = {'l': 55, 'r': 20, 't': 60, 'b': 20}
+NARROW_MARGIN = {'l': 55, 'r': 20, 't': 40, 'b': 20}
+TIGHT_MARGIN = {'l': 20, 'r': 20, 't': 40, 'b': 20}
+
+
+@lru_cache(maxsize=None)
+def colorscale(start, end, n):
+    """n hex colors from start to end."""
+    return tuple(x.hex for x in Color(start).range_to(Color(end), n))
+
+
+BLUES = ('#b2d8ff', '#00264c')
+GREENS = ('#a0f093', '#1b6c0f')
+
+SPM_BLUES = colorscale(*BLUES, 5)[::-1]
+
+
+def scatter(x, y, name, color, mode='lines', size=None, yaxis=None):
+    marker = {'color': color}
+    if size is not None:
+        marker['size'] = size
+    trace = {'type': 'scatter', 'x': x, 'y': y, 'mode': mode, 'name': name, 'marker': marker}
+    if yaxis is not None:
+        trace['yaxis'] = yaxis
+    return trace
+
+
+def legend(x, y):
+    return {'x': x, 'y': y, 'traceorder': 'normal', 'font': LEGEND_FONT}
+
+
+def figure(traces, title, width, margin=WIDE_MARGIN, xaxis_title=None, legend=None):
+    layout = dict(BASE_LAYOUT, width=width, margin=margin, title={'text': title})
+    if xaxis_title is not None:
+        layout['xaxis'] = {'title': {'text': xaxis_title}}
+    if legend is not None:
+        layout['legend'] = legend
+    return {'data': traces, 'layout': layout}
+
+
+def secondary_y_figure(traces, secondary_traces, title, width, yaxis_title, secondary_yaxis_title, **kwargs):
+    """Figure with a second y axis on the right, like make_subplots(specs=[[{'secondary_y': True}]])."""
+    fig = figure(list(traces) + [dict(trace, yaxis='y2') for trace in secondary_traces], title, width, **kwargs)
+    layout = fig['layout']
+    layout['xaxis'] = dict(layout.get('xaxis', {}), domain=[0, 0.94], anchor='y')
+    layout['yaxis'] = {'anchor': 'x', 'title': {'text': yaxis_title}}
+    layout['yaxis2'] = {'anchor': 'x', 'overlaying': 'y', 'side': 'right', 'title': {'text': secondary_yaxis_title}}
+    return fig
+
+
+def voltage_figure(time, voltage, slice_time, amps, color):
+    """Voltage curve with the vertical time-slice indicator the time slider moves."""
+    return figure(
+        [scatter(time, voltage, 'Voltage', color),
+         scatter([slice_time, slice_time], [2, 4.2], 'Time Slice', GREY)],
+        f'Discharge Voltage vs Time at {amps} Amps with Current Time Indicator',
+        1000, xaxis_title='Time (s)', legend=legend(0, .5))
+
+
+def potential_figure(time, positive, negative, marker_index, colors):
+    """Electrode potentials with the current-time markers the time slider moves.
+
+    colors is (positive line, positive marker, negative line, negative marker)."""
+    return secondary_y_figure(
+        [scatter(time, positive, 'Positive Electrode Potential', colors[0]),
+         scatter([time[marker_index]], [positive[marker_index]], 'Current PE Potential', colors[1], mode='markers', size=10)],
+        [scatter(time, negative, 'Negative Electrode Potential', colors[2]),
+         scatter([time[marker_index]], [negative[marker_index]], 'Current NE Potential', colors[3], mode='markers', size=10)],
+        'Positive and Negative Electrode Potentials', 1000,
+        'Positive Electrode Potential (V)', 'Negative Electrode Potential (V)',
+        xaxis_title='Time (s)', legend=legend(0.05, .3))
+
+
+def concentration_figure(traces, title, margin=NARROW_MARGIN, legend=None):
+    return figure(traces, title, 500, margin=margin, xaxis_title='Distance From Center Of Particle (m)', legend=legend)
+
+
+def live_voltage_figure(amps, color):
+    """Empty voltage curve that a simulation stream extends as the solver advances."""
+    return figure([scatter([], [], 'Voltage', color)], f'Solving at {amps} Amps...', 1000,
+                  xaxis_title='Time (s)', legend=legend(0, .5))
+
+
+def live_potential_figure(colors):
+    """Empty electrode potentials that a simulation stream extends. colors is (positive, negative)."""
+    return secondary_y_figure(
+        [scatter([], [], 'Positive Electrode Potential', colors[0])],
+        [scatter([], [], 'Negative Electrode Potential', colors[1])],
+        'Positive and Negative Electrode Potentials', 1000,
+        'Positive Electrode Potential (V)', 'Negative Electrode Potential (V)',
+        xaxis_title='Time (s)', legend=legend(0.05, .3))
@@ -0,0 +1,304 @@
+"""Background simulation jobs, run on a process pool and polled by the pages.
+
+Job state lives in a spool directory rather than in memory, because the poll for a job
+can land on a different gunicorn worker than the one that submitted it. Each job has a
+``<id>.json`` status file and, once finished, a ``<id>.npz`` with the result arrays.
+A job submitted with a key is also recorded in ``key-<digest>``, so an identical job
+submitted from another worker shares it."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from ampere.base_battery import ChargeResult
+
+QUEUED = 'queued'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised when a worker already has the maximum number of pending jobs."""
+
+
+class InlineExecutor:
+    """Executor that runs each job immediately in the calling thread, for tests and debugging."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def key_digest(key):
+    """A digest of a cache key for file names, the same in every process."""
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def save_result(path, result):
+    """Write a ChargeResult to path as .npz, atomically, since other processes poll for it."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **{k: v for k, v in result._asdict().items() if v is not None})
+    os.replace(tmp, path)
+
+
+def load_result(path):
+    with np.load(path) as f:
+        return ChargeResult(*[f[field] if field in f else None for field in ChargeResult._fields])
+
+
+def prune(directory, ttl):
+    """Remove the files in directory older than ttl seconds."""
+    cutoff = time.time() - ttl
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+EXECUTORS = {
+    'process': ProcessPoolExecutor,
+    'thread': ThreadPoolExecutor,
+    'inline': lambda max_workers=None: InlineExecutor(),
+}
+
+
+class JobQueue:
+    """Bounded queue of simulation jobs with per-job timeouts.
+
+    The executor is created on first submit, so the queue is safe to build before
+    gunicorn forks its workers. A job that overruns its timeout is reported as failed;
+    a process pool cannot interrupt a running solve, so it keeps its process busy until it
+    finishes, and its result is discarded."""
+
+    def __init__(self, directory, executor='process', max_workers=None, max_pending=8, timeout=120,
+                 ttl=3600):
+        self.directory = directory
+        self.executor_name = executor
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.ttl = ttl
+        self._executor = None
+        self._pending = {}
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = EXECUTORS[self.executor_name](max_workers=self.max_workers)
+        return self._executor
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.directory, f'{job_id}.{ext}')
+
+    def _write_status(self, job_id, status):
+        # a private temp file, since a job reporting progress writes its status from another process
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(status, f)
+        os.replace(tmp, self._path(job_id, 'json'))
+
+    def _read_status(self, job_id):
+        try:
+            with open(self._path(job_id, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def expected_duration(self, kind):
+        return self._durations.get(kind, self.timeout / 4)
+
+    def _create(self, kind, timeout, **details):
+        job_id = uuid.uuid4().hex
+        status = {
+            'state': QUEUED,
+            'kind': kind,
+            'submitted': time.time(),
+            'timeout': timeout or self.timeout,
+            'expected': self.expected_duration(kind),
+            **details,
+        }
+        self._write_status(job_id, status)
+        return job_id, status
+
+    def submit(self, fn, *args, kind='job', key=None, timeout=None, on_result=None, progress=False, **details):
+        """Queue fn(*args) and return its job id.
+
+        Jobs submitted with the same key while one is still pending, in this worker or
+        another, share its id, as do those submitted after it finished while its result
+        is still kept.
+        on_result is called with the result in this process once the job finishes.
+        With progress, fn is called as fn(directory, job_id, *args), so it can report
+        with JobQueue(directory).update(). details are stored in the status file."""
+        with self._lock:
+            if key is not None:
+                for job_id, (pending_key, _) in self._pending.items():
+                    if pending_key == key:
+                        return job_id
+                holder = self._key_holder(key)
+                if holder is not None:
+                    return holder
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(f'{len(self._pending)} jobs already pending')
+            os.makedirs(self.directory, exist_ok=True)
+            self._prune()
+
+            job_id, status = self._create(kind, timeout, **details)
+            if key is not None:
+                holder = self._claim_key(key, job_id)
+                if holder != job_id:
+                    os.remove(self._path(job_id, 'json'))
+                    return holder
+            if progress:
+                args = (self.directory, job_id, *args)
+            future = self.executor.submit(fn, *args)
+            self._pending[job_id] = (key, future)
+        future.add_done_callback(lambda f: self._finish(job_id, status, f, on_result))
+        return job_id
+
+    def _shared_job(self, job_id):
+        """Whether another submit of the same key can share job_id: it is pending or its result is kept."""
+        status = self._read_status(job_id)
+        if status is None:
+            return False
+        if status['state'] == QUEUED:
+            return time.time() - status['submitted'] <= status['timeout']
+        return status['state'] == DONE and os.path.exists(self._path(job_id, 'npz'))
+
+    def _key_path(self, key):
+        return os.path.join(self.directory, f'key-{key_digest(key)}')
+
+    def _key_holder(self, key):
+        """The id of the job that holds key, if another submit of it can share the job."""
+        try:
+            with open(self._key_path(key)) as f:
+                holder = f.read()
+        except OSError:
+            return None
+        return holder if self._shared_job(holder) else None
+
+    def _claim_key(self, key, job_id):
+        """Record job_id as the job for key across workers, unless another job already holds it.
+
+        Returns the id of the job that holds the key."""
+        path = self._key_path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(job_id)
+        try:
+            while True:
+                # a link, unlike a rename, fails if the key is already held
+                try:
+                    os.link(tmp, path)
+                    return job_id
+                except FileExistsError:
+                    pass
+                holder = self._key_holder(key)
+                if holder is not None:
+                    return holder
+                # left by a job that failed, timed out or was pruned
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        finally:
+            os.remove(tmp)
+
+    def _finish(self, job_id, status, future, on_result):
+        with self._lock:
+            self._pending.pop(job_id, None)
+        elapsed = time.time() - status['submitted']
+        # keep whatever the job reported with update()
+        status = dict(self._read_status(job_id) or status, finished=time.time())
+        try:
+            result = future.result()
+        except Exception as e:
+            status.update(state=FAILED, error=str(e) or type(e).__name__)
+        else:
+            if elapsed > status['timeout']:
+                status.update(state=FAILED, error='timed out')
+            else:
+                self._store(job_id, status, result, elapsed)
+                if on_result is not None:
+                    on_result(result)
+        self._write_status(job_id, status)
+
+    def _store(self, job_id, status, result, elapsed):
+        save_result(self._path(job_id, 'npz'), result)
+        status.update(state=DONE)
+        self._durations[status['kind']] = elapsed
+
+    def update(self, job_id, **fields):
+        """Merge fields into the status of a queued job. Returns False if the job is no longer queued."""
+        status = self._read_status(job_id)
+        if status is None or status['state'] != QUEUED:
+            return False
+        status.update(fields)
+        self._write_status(job_id, status)
+        return True
+
+    def status(self, job_id):
+        """Return the status dict of a job, with an estimated progress fraction, or None."""
+        status = self._read_status(job_id)
+        if status is None:
+            return None
+        if status['state'] == QUEUED:
+            elapsed = time.time() - status['submitted']
+            if elapsed > status['timeout']:
+                status.update(state=FAILED, error='timed out')
+                with self._lock:
+                    _, future = self._pending.pop(job_id, (None, None))
+                if future is not None:
+                    future.cancel()
+                self._write_status(job_id, status)
+            elif 'progress' not in status:
+                status['progress'] = min(elapsed / status['expected'], 0.95)
+        if status['state'] == DONE:
+            status['progress'] = 1.0
+        return status
+
+    def result(self, job_id):
+        """Load the ChargeResult of a finished job."""
+        return load_result(self._path(job_id, 'npz'))
+
+    def _prune(self):
+        prune(self.directory, self.ttl)
+
+
+queue = None
+
+
+def default_workers():
+    """Solver processes per web worker, so that the workers' pools together use each core once."""
+    web_workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+def configure(config):
+    """Build the shared job queue from the Flask config."""
+    global queue
+    queue = JobQueue(
+        config['SIMULATION_JOB_DIR'],
+        executor=config.get('SIMULATION_JOB_EXECUTOR', 'process'),
+        max_workers=config.get('SIMULATION_JOB_WORKERS') or default_workers(),
+        max_pending=config.get('SIMULATION_JOB_MAX_PENDING', 8),
+        timeout=config.get('SIMULATION_JOB_TIMEOUT', 120),
+    )
+    return queue
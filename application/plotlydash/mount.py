@@ -0,0 +1,84 @@
+"""Mounting of the Dash app, either at startup or on the first request that needs it.
+
+DASH_MOUNT picks how:
+
+- ``eager`` (the default) builds the Dash app on the blog's Flask app during startup.
+- ``lazy`` only installs a dispatcher. The first request under /dashapp/ or the simulation
+  API imports ampere, scipy, plotly and the page layouts and builds the Dash app on a Flask
+  app of its own that shares the blog's config. Workers that only ever serve the blog
+  never load any of it.
+- ``off`` never builds it and answers those prefixes with 404, for blog-only workers
+  behind a proxy that sends them to workers of their own.
+
+Importing this module loads nothing from Dash or the solvers."""
+import threading
+
+from flask import Flask
+from werkzeug.exceptions import NotFound
+
+from .. import compression
+from ..startup import StartupTimer
+
+DASH_PREFIX = '/dashapp/'
+# the simulation API shares the Dash app's solver and job configuration
+PREFIXES = (DASH_PREFIX, '/api/simulate')
+MODES = ('eager', 'lazy', 'off')
+
+
+def build(server, pages, timer):
+    """Import the simulation pages and build the Dash app on server."""
+    with timer.phase('dash imports'):
+        from .dashboard import init_dashboard
+    with timer.phase('dash layout'):
+        init_dashboard(server, pages)
+
+
+class LazyDashboard:
+    """WSGI middleware that builds the Dash app on the first request under PREFIXES."""
+
+    def __init__(self, app, pages, enabled=True):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.pages = pages
+        self.enabled = enabled
+        self.server = None
+        self._lock = threading.Lock()
+
+    def mount(self):
+        if self.server is None:
+            with self._lock:
+                if self.server is None:
+                    timer = StartupTimer('Dash mount')
+                    server = Flask(self.app.import_name, static_folder=None)
+                    # shared, so settings the dashboard fills in are seen by the blog's simulation API too
+                    server.config = self.app.config
+                    with server.app_context():
+                        build(server, self.pages, timer)
+                        if server.config.get('COMPRESS_ASSETS_WARM', True):
+                            with timer.phase('precompress assets'):
+                                compression.store.build()
+                    self.app.extensions['dash_mount_timer'] = timer
+                    self.app.logger.info(timer.report())
+                    self.server = server
+        return self.server
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(PREFIXES):
+            if not self.enabled:
+                return NotFound()(environ, start_response)
+            server = self.mount()
+            if path.startswith(DASH_PREFIX):
+                return server.wsgi_app(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+
+def init_app(app, pages, timer):
+    """Mount the Dash app on app as DASH_MOUNT says."""
+    mode = app.config.get('DASH_MOUNT', 'eager')
+    if mode not in MODES:
+        raise ValueError(f'DASH_MOUNT must be one of {", ".join(MODES)}, not {mode!r}')
+    if mode == 'eager':
+        build(app, pages, timer)
+    else:
+        app.wsgi_app = LazyDashboard(app, pages, enabled=mode == 'lazy')
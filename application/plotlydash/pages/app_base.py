@@ -3,15 +3,16 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 
+from ... import bundles
+
 def init_app(server):
     dash_app = dash.Dash(
             server=server,
             routes_pathname_prefix='/dashapp/',
-            external_stylesheets=[
-                dbc.themes.BOOTSTRAP,
-                '/static/css/milligram.min.css',
-                '/static/css/style.css',
-            ],
+            external_stylesheets=[dbc.themes.BOOTSTRAP, *bundles.stylesheet_urls()],
+            external_scripts=['/static/js/simulation.js'],
+            # responses are compressed by application.compression instead
+            compress=False,
             title='Visualizations'
         )
     dash_app.config.suppress_callback_exceptions = True
@@ -3,17 +3,18 @@ import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
 import numpy as np
-import json
-import plotly.graph_objects as go
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from ampere import SingleParticleFD, SingleParticleFDSEI
 from ampere.base_battery import ChargeResult
-from scipy.interpolate import interp1d
-from plotly.subplots import make_subplots
-from colour import Color
+from ... import metrics
+from .. import figures, transport
+from ..decimation import decimate
+from ..interpolation import interpolate_blocks
+from ..simulation import CURRENT_RANGES, normalize_current, simulate
 
 
 def init_page(app):
+    min_current, max_current = CURRENT_RANGES['SPM']
     layout = html.Div([
         html.H1('Single Particle Model'),
         html.Div([], style={'height': '30px'}),
@@ -23,8 +24,8 @@ def init_page(app):
         html.Img(src='/img/spm/spm_3d.png'),
         html.Div([], style={'height': '30px'}),
         html.P('Select a current for the simulation below.'),
-        dcc.Slider(id='spm-current', min=-10, max=10, value=4, step=0.1, updatemode='drag',
-                   marks={i: f'{i} amps' for i in range(-10, 12, 2)}),
+        dcc.Slider(id='spm-current', min=min_current, max=max_current, value=4, step=0.1, updatemode='drag',
+                   marks={i: f'{i} amps' for i in range(min_current, max_current + 2, 2)}),
         html.Div([], style={'height': '30px'}),
         dbc.Button('Run Simulation', id='spm-start-button'),
 
@@ -40,166 +41,58 @@ def init_page(app):
         if amps != 0:
             spm = SingleParticleFD()
             # run simulation with internal variables
-            if amps > 0:
-                amps = max(amps, 0.2)
-                data = spm.discharge(current=amps, internal=True, trim=True)
-            if amps <= 0:
-                amps = min(amps, -0.2)
-                data = spm.charge(current=abs(amps), internal=True, trim=True)
+            amps = normalize_current(amps)
+            data = simulate(SingleParticleFD, None, amps)
+            # the model and solve phases, on a cache miss, are timed by simulation.solve
+            laps = metrics.Laps(SingleParticleFD.__name__)
 
             internal_data = data.internal
             raw_times = internal_data[:, 0]
             delta_time = np.diff(raw_times)
             total_capacity = round(abs(delta_time * internal_data[1:, -1]).sum() / 3600 / 30, 2) # convert from seconds to hours
 
-            start_color = "#b2d8ff"  # light blue
-            end_color = "#00264c"  # dark blue
-
-            # list of "N" colors between "start_color" and "end_color"
-            colorscale = [x.hex for x in list(Color(start_color).range_to(Color(end_color), 5))][::-1]
-            light_green = 'rgb(33, 209, 59)'
-            dark_green = 'darkgreen'
-
-            positive_potential = linearly_interpolate_concentrations(data.time, raw_times, internal_data[:, -4:-3])
-            negative_potential = linearly_interpolate_concentrations(data.time, raw_times, internal_data[:, -3:-2])
-            data = ChargeResult(data.time, data.voltage, None, None)
+            # decimate before interpolating, so the internal states are only evaluated on the scrubbing grid
+            voltage_index, state_index = decimate(data.time, data.voltage)
+            state_time = data.time[state_index]
+            positive_potential, negative_potential, pos_conc, neg_conc = interpolate_blocks(
+                state_time, raw_times, internal_data,
+                [[-4], [-3], spm.internal_structure['positive_concentration'], spm.internal_structure['negative_concentration']])
+            voltage_trace = ChargeResult(data.time[voltage_index], data.voltage[voltage_index], None, None)
+            data = ChargeResult(state_time, data.voltage[state_index], None, None)
+            laps.lap('interpolation')
 
             pos_electrode = spm.initial_parameters['N1']
             neg_electrode = spm.initial_parameters['N2']
             initial_time = 1
-            voltage_fig = go.Figure()
-            voltage_fig.add_trace(go.Scatter(x=data.time, y=data.voltage, mode='lines', name='Voltage', marker={'color': dark_green}))
-            voltage_fig.add_trace(go.Scatter(x=[data.time[initial_time], data.time[initial_time]], y=[2, 4.2], mode='lines', name='Time Slice', marker={'color': 'darkgrey'}))
-            voltage_fig.update_layout(
-                margin=dict(l=55, r=20, t=60, b=20),
-                paper_bgcolor="rgb(240, 240, 240)",
-                plot_bgcolor='rgb(220, 220, 220)',
-                width=1000,
-                height=350,
-                title=f'Discharge Voltage vs Time at {amps} Amps with Current Time Indicator',
-                xaxis_title="Time (s)",
-                legend=dict(
-                    x=0,
-                    y=.5,
-                    traceorder="normal",
-                    font=dict(
-                        family="sans-serif",
-                        size=12,
-                        color="black"
-                    ),
-                ),
-            )
-
-            internal_pot_fig = make_subplots(specs=[[{"secondary_y": True}]])
-
-            internal_pot_fig.add_trace(go.Scatter(x=data.time, y=positive_potential.T[0], mode='lines', name='Positive Electrode Potential', marker={'color': dark_green}), secondary_y=False)
-            internal_pot_fig.add_trace(go.Scatter(x=[data.time[4]], y=[positive_potential.T[0][4]], mode='markers', name='Current PE Potential', marker={'color': light_green, 'size': 10}), secondary_y=False)
-            internal_pot_fig.add_trace(go.Scatter(x=data.time, y=negative_potential.T[0], mode='lines', name='Negative Electrode Potential', marker={'color': colorscale[0]}), secondary_y=True)
-            internal_pot_fig.add_trace(go.Scatter(x=[data.time[4]], y=[negative_potential.T[0][4]], mode='markers', name='Current NE Potential', marker={'color': colorscale[1], 'size': 10}), secondary_y=True)
-            internal_pot_fig.update_layout(
-                margin=dict(l=55, r=20, t=60, b=20),
-                paper_bgcolor="rgb(240, 240, 240)",
-                plot_bgcolor='rgb(220, 220, 220)',
-                width=1000,
-                height=350,
-                title='Positive and Negative Electrode Potentials',
-                xaxis_title="Time (s)",
-                legend=dict(
-                    x=0.05,
-                    y=.3,
-                    traceorder="normal",
-                    font=dict(
-                        family="sans-serif",
-                        size=12,
-                        color="black"
-                    ),
-                ),
-            )
-            internal_pot_fig.update_yaxes(title_text="Positive Electrode Potential (V)", secondary_y=False)
-            internal_pot_fig.update_yaxes(title_text="Negative Electrode Potential (V)", secondary_y=True)
+            voltage_fig = figures.voltage_figure(voltage_trace.time, voltage_trace.voltage, data.time[initial_time], amps, figures.DARK_GREEN)
+            internal_pot_fig = figures.potential_figure(
+                data.time, positive_potential.T[0], negative_potential.T[0], 4,
+                (figures.DARK_GREEN, figures.LIGHT_GREEN, figures.SPM_BLUES[0], figures.SPM_BLUES[1]))
 
-            dict_data = {'voltage_data': {'time': list(data.time), 'voltage': list(data.voltage)}}
+            dict_data = {'voltage_data': {'time': data.time, 'voltage': data.voltage}}
 
             pos_radius = np.linspace(0, 1, pos_electrode + 2) * spm.initial_parameters['Rp']
             neg_radius = np.linspace(0, 1, neg_electrode + 2) * spm.initial_parameters['Rn']
 
-            pos_conc = internal_data[:, spm.internal_structure['positive_concentration']]
-            pos_conc = linearly_interpolate_concentrations(data.time, raw_times, pos_conc) / spm.initial_parameters['cspmax']
+            pos_conc = pos_conc / spm.initial_parameters['cspmax']
+            neg_conc = neg_conc / spm.initial_parameters['csnmax']
 
-            neg_conc = internal_data[:, spm.internal_structure['negative_concentration']]
-            neg_conc = linearly_interpolate_concentrations(data.time, raw_times, neg_conc) / spm.initial_parameters['csnmax']
-
-            pos_internal_fig = go.Figure()
-            pos_internal_fig.add_trace(
-                go.Scatter(x=pos_radius,
-                           y=pos_conc[0, :].T,
-                           mode='lines',
-                           name='Original Li Concentration',
-                           marker={'color': dark_green}))
-            pos_internal_fig.add_trace(
-                go.Scatter(x=pos_radius,
-                           y=pos_conc[initial_time, :].T,
-                           mode='lines',
-                           name='Current Concentration',
-                           marker={'color': light_green}))
-            pos_internal_fig.update_layout(
-                margin=dict(l=55, r=20, t=40, b=20),
-                paper_bgcolor="rgb(240, 240, 240)",
-                plot_bgcolor='rgb(220, 220, 220)',
-                width=500,
-                height=350,
-                legend=dict(
-                    x=0,
-                    y=.5,
-                    traceorder="normal",
-                    font=dict(
-                        family="sans-serif",
-                        size=12,
-                        color="black"
-                    ),
-                ),
-                title='Positive Particle Li Concentration',
-                xaxis_title="Distance From Center Of Particle (m)",
-            )
-
-            neg_internal_fig = go.Figure()
-            neg_internal_fig.add_trace(go.Scatter(x=neg_radius,
-                                                  y=neg_conc[0, :].T,
-                                                  mode='lines',
-                                                  name='Original Li Concentration',
-                                                  marker={'color': colorscale[0]}))
-            neg_internal_fig.add_trace(go.Scatter(x=neg_radius,
-                                                  y=neg_conc[initial_time, :].T,
-                                                  mode='lines',
-                                                  name='Current Concentration',
-                                                  marker={'color': colorscale[1]}))
-            neg_internal_fig.update_layout(
-                margin=dict(l=20, r=20, t=40, b=20),
-                paper_bgcolor="rgb(240, 240, 240)",
-                plot_bgcolor='rgb(220, 220, 220)',
-                width=500,
-                height=350,
-                legend=dict(
-                    x=0,
-                    y=.3,
-                    traceorder="normal",
-                    font=dict(
-                        family="sans-serif",
-                        size=12,
-                        color="black"
-                    ),
-                ),
-                title='Negative Particle Li Concentration',
-                xaxis_title="Distance From Center Of Particle (m)",
-            )
+            pos_internal_fig = figures.concentration_figure(
+                [figures.scatter(pos_radius, pos_conc[0, :].T, 'Original Li Concentration', figures.DARK_GREEN),
+                 figures.scatter(pos_radius, pos_conc[initial_time, :].T, 'Current Concentration', figures.LIGHT_GREEN)],
+                'Positive Particle Li Concentration', legend=figures.legend(0, .5))
+            neg_internal_fig = figures.concentration_figure(
+                [figures.scatter(neg_radius, neg_conc[0, :].T, 'Original Li Concentration', figures.SPM_BLUES[0]),
+                 figures.scatter(neg_radius, neg_conc[initial_time, :].T, 'Current Concentration', figures.SPM_BLUES[1])],
+                'Negative Particle Li Concentration', margin=figures.TIGHT_MARGIN, legend=figures.legend(0, .3))
 
             dict_data['internal_data'] = {
-                'positive': [list(time_slice) for time_slice in pos_conc],
-                'negative': [list(time_slice) for time_slice in neg_conc],
-                'p_x': list(pos_radius),
-                'n_x': list(neg_radius),
-                'p_pot': list(positive_potential.T[0]),
-                'n_pot': list(negative_potential.T[0])
+                'positive': pos_conc,
+                'negative': neg_conc,
+                'p_x': pos_radius,
+                'n_x': neg_radius,
+                'p_pot': positive_potential.T[0],
+                'n_pot': negative_potential.T[0]
             }
 
             l = html.Div([
@@ -240,30 +133,18 @@ def init_page(app):
                 ]),
             ])
 
-            return l, json.dumps(dict_data)
+            laps.lap('figures')
+            return l, transport.dumps(dict_data)
         return None, ''
 
     app.clientside_callback(
-        """
-        function(time, data) {
-            // tuple is (dict of new data, target trace index, number of points to keep)
-            const _data = JSON.parse(data)['voltage_data']['time'];
-            return [{'x':[[_data[time], _data[time]]], 'y': [[2, 4.2]]}, [1], 2];
-        }
-        """, Output('spm-voltage-graph', 'extendData'), [Input('spm-time', 'value')], [State('spm-data-div', 'children')]
+        ClientsideFunction(namespace='simulation', function_name='time_indicator'),
+        Output('spm-voltage-graph', 'extendData'), [Input('spm-time', 'value')], [State('spm-data-div', 'children')]
     )
 
     app.clientside_callback(
-        """
-        function(time, data) {
-            // tuple is (dict of new data, target trace index, number of points to keep)
-            const _data = JSON.parse(data);
-            const _time = _data['voltage_data']['time'];
-            const pot = _data['internal_data']['p_pot'];
-            const npot = _data['internal_data']['n_pot'];
-            return [{'x': [[_time[time]], [_time[time]]], 'y': [[pot[time]], [npot[time]]] }, [1, 3], 1];
-        }
-        """, Output('spm-potential-graph', 'extendData'), [Input('spm-time', 'value')],
+        ClientsideFunction(namespace='simulation', function_name='potential_markers'),
+        Output('spm-potential-graph', 'extendData'), [Input('spm-time', 'value')],
         [State('spm-data-div', 'children')]
     )
     # @app.callback(Output('spm-potential-graph', 'extendData'), [Input('spm-time', 'value')],
@@ -276,31 +157,13 @@ def init_page(app):
     #     return {'x': [[_time[time]], [_time[time]]], 'y': [[pot[time]], [npot[time]]]}, [1, 3], 1
 
     app.clientside_callback(
-        """
-        function(time, data) {
-            // tuple is (dict of new data, target trace index, number of points to keep)
-            const _data = JSON.parse(data);
-            const positive = _data['internal_data']['positive'];
-            const _px = _data['internal_data']['p_x'];
-            return [{'x': [_px], 'y': [positive[time]]}, [1], _px.length];
-        }
-        """, Output('spm-pos-graph', 'extendData'), [Input('spm-time', 'value')],[State('spm-data-div', 'children')]
+        ClientsideFunction(namespace='simulation', function_name='spm_positive'),
+        Output('spm-pos-graph', 'extendData'), [Input('spm-time', 'value')],[State('spm-data-div', 'children')]
     )
 
     app.clientside_callback(
-        """
-        function(time, data) {
-            // tuple is (dict of new data, target trace index, number of points to keep)
-            const _data = JSON.parse(data);
-            const negative = _data['internal_data']['negative'];
-            const _nx = _data['internal_data']['n_x'];
-            return [{'x': [_nx], 'y': [negative[time]]}, [1], _nx.length];
-        }
-        """, Output('spm-neg-graph', 'extendData'), [Input('spm-time', 'value')], [State('spm-data-div', 'children')]
+        ClientsideFunction(namespace='simulation', function_name='spm_negative'),
+        Output('spm-neg-graph', 'extendData'), [Input('spm-time', 'value')], [State('spm-data-div', 'children')]
     )
 
     return layout
-
-
-def linearly_interpolate_concentrations(time, raw_time, concentrations):
-    return np.concatenate([interp1d(raw_time, concentrations[:, i], kind='cubic', bounds_error=False)(time)[:, np.newaxis] for i in range(concentrations.shape[1])], axis=1)
\ No newline at end of file
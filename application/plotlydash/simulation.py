@@ -0,0 +1,337 @@
+"""Shared simulation runner with a single-flight LRU result cache."""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from ampere import SingleParticleFD, SingleParticleFDSEI, PseudoTwoDimFD
+from ampere.base_battery import ChargeResult
+
+from .. import metrics
+from . import jobs
+from .atlas import load_atlases
+
+# the P2D page runs a coarser grid than the ampere defaults so it stays interactive
+P2D_PARAMETERS = {'Nr1': 7, 'Nr2': 7, 'N1': 11, 'N3': 11, 'lp': 50e-6, 'Dsp': 3.5e-13}
+
+MODELS = {
+    'SPM': (SingleParticleFD, None),
+    'SPM-SEI': (SingleParticleFDSEI, None),
+    'P2D': (PseudoTwoDimFD, P2D_PARAMETERS),
+}
+
+# slider domains of the spm-current and p2d-current sliders, in amps
+CURRENT_RANGES = {
+    'SPM': (-10, 10),
+    'P2D': (-8, 10),
+}
+
+# the solvers are unstable below this magnitude, so the pages clamp to it
+MIN_CURRENT = 0.2
+
+
+def normalize_current(amps):
+    """Clamp a slider current away from zero and snap it to the slider step."""
+    if amps > 0:
+        amps = max(amps, MIN_CURRENT)
+    else:
+        amps = min(amps, -MIN_CURRENT)
+    return round(amps, 1)
+
+
+def time_grid(amps, points=500):
+    """Time grid of a full charge or discharge, long enough for the default cells to reach the
+    cutoff voltage, where trim=True ends the run: 4000 amp-seconds of discharge or 5000 of charge."""
+    horizon = (4000 if amps > 0 else 5000) / abs(amps)
+    return np.linspace(0, horizon, points)
+
+
+def solve(model_cls, initial_parameters, amps):
+    """Run a full charge or discharge with internal states. Positive current discharges."""
+    laps = metrics.Laps(model_cls.__name__)
+    model = model_cls(initial_parameters=initial_parameters)
+    laps.lap('model')
+    if amps > 0:
+        result = model.discharge(time_grid(amps), current=amps, internal=True, trim=True)
+    else:
+        result = model.charge(time_grid(amps), current=abs(amps), internal=True, trim=True)
+    laps.lap('solve')
+    return result
+
+
+def solve_windows(model_cls, initial_parameters, amps, windows=20, points=25):
+    """Run the same charge or discharge as solve() in fixed time windows, yielding each one as it finishes.
+
+    Every window continues from the state the previous one ended in, and its times (including
+    the internal-state time column) are offset to the start of the run. Iteration stops once
+    a window ends early at the voltage cutoff, or at the end of time_grid()."""
+    laps = metrics.Laps(model_cls.__name__)
+    model = model_cls(initial_parameters=initial_parameters)
+    laps.lap('model')
+    # one solve observation per run, of the time spent in the solver only, not between windows
+    solving = 0
+    current = abs(amps)
+    run = model.discharge if amps > 0 else model.charge
+    # neighbouring windows share their boundary sample
+    step = points - 1
+    full = time_grid(amps, windows * step + 1)
+    for i in range(windows):
+        start = full[i * step]
+        grid = full[i * step:(i + 1) * step + 1] - start
+        window_start = time.perf_counter()
+        result = run(grid, current=current, from_current_state=i > 0, internal=True, trim=True)
+        solving += time.perf_counter() - window_start
+        internal = np.array(result.internal, dtype=float)
+        internal[:, 0] += start
+        # the first sample of a window repeats the last sample of the previous one
+        skip = 1 if i > 0 else 0
+        yield ChargeResult(result.time[skip:] + start, result.voltage[skip:], result.current[skip:], internal[skip:])
+        if len(result.time) < points:
+            break
+    metrics.observe_phase(model_cls.__name__, 'solve', solving)
+
+
+def assemble_windows(windows):
+    """Join the windows from solve_windows into one ChargeResult."""
+    return ChargeResult(*[np.concatenate([getattr(w, field) for w in windows]) for field in ChargeResult._fields])
+
+
+def potential_columns(model):
+    """Internal-state columns of the positive and negative electrode potentials."""
+    structure = model.internal_structure
+    if 'solid_phase_potential' in structure:
+        return structure['solid_phase_potential']['positive'][0], structure['solid_phase_potential']['negative'][-1]
+    return -4, -3
+
+
+def warm_up():
+    """Run a tiny solve of every model, so the first real request does not pay the solvers' one-off setup."""
+    for model_cls, initial_parameters in MODELS.values():
+        model = model_cls(initial_parameters=initial_parameters)
+        model.discharge(t=np.linspace(0, 10, 5), current=1, internal=True)
+
+
+def result_nbytes(result):
+    return sum(np.asarray(x).nbytes for x in result if x is not None)
+
+
+def freeze_result(result):
+    """Mark the result arrays read-only, since cached results are shared between requests."""
+    arrays = []
+    for x in result:
+        if x is not None:
+            x = np.asarray(x)
+            x.flags.writeable = False
+        arrays.append(x)
+    return ChargeResult(*arrays)
+
+
+def cache_key(model_cls, initial_parameters, amps):
+    parameters = tuple(sorted((initial_parameters or {}).items()))
+    return model_cls.__name__, parameters, amps
+
+
+class _Flight:
+    """A solve in progress that later callers for the same key wait on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SharedFlights:
+    """Single-flight of solves across processes, through files in the shared job directory.
+
+    The first process to create ``flight-<digest>.claim`` for a key solves it and writes
+    ``flight-<digest>.npz``; the others poll for that file, as the pages poll a job's status,
+    and later callers load it until it is pruned after ttl seconds. A claim older than the
+    timeout was left by a process that died, and is taken over. If the solve fails, the
+    claim is dropped and the next waiter solves."""
+
+    def __init__(self, directory, timeout=120, ttl=3600, interval=0.1):
+        self.directory = directory
+        self.timeout = timeout
+        self.ttl = ttl
+        self.interval = interval
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, f'flight-{jobs.key_digest(key)}.{ext}')
+
+    def _load(self, key):
+        try:
+            return jobs.load_result(self._path(key, 'npz'))
+        except OSError:
+            return None
+
+    def _claim(self, key):
+        path = self._path(key, 'claim')
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - os.path.getmtime(path) > self.timeout:
+                os.remove(path)
+        except OSError:
+            pass
+        return False
+
+    def get_or_compute(self, key, compute):
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            result = self._load(key)
+            if result is not None:
+                return result
+            if self._claim(key):
+                break
+            time.sleep(self.interval)
+        try:
+            # the process that held the claim may have written the result just before it was taken
+            result = self._load(key)
+            if result is None:
+                result = compute()
+                jobs.save_result(self._path(key, 'npz'), result)
+                jobs.prune(self.directory, self.ttl)
+            return result
+        finally:
+            try:
+                os.remove(self._path(key, 'claim'))
+            except FileNotFoundError:
+                pass
+
+
+class SimulationCache:
+    """LRU cache of simulation results bounded by entry count and total array bytes.
+
+    Concurrent requests for the same key are coalesced: the first caller solves while
+    the others block until its result (or exception) is available. With shared set to
+    a SharedFlights, the first caller in each process goes through it, so requests in
+    different gunicorn workers are coalesced too."""
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.shared = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return result
+
+    def put(self, key, result):
+        size = result_nbytes(result)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= result_nbytes(self._entries.pop(key))
+            if size > self.max_bytes:
+                return
+            self._entries[key] = result
+            self.nbytes += size
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= result_nbytes(evicted)
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            if self.shared is not None:
+                flight.result = freeze_result(self.shared.get_or_compute(key, compute))
+            else:
+                flight.result = freeze_result(compute())
+            self.put(key, flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+cache = SimulationCache()
+atlases = {}
+
+
+def configure(config):
+    """Size the shared cache and open the precomputed atlases from the Flask config."""
+    cache.max_entries = config.get('SIMULATION_CACHE_ENTRIES', cache.max_entries)
+    cache.max_bytes = config.get('SIMULATION_CACHE_BYTES', cache.max_bytes)
+    cache.shared = SharedFlights(config['SIMULATION_JOB_DIR'], timeout=config.get('SIMULATION_JOB_TIMEOUT', 120))
+    atlases.clear()
+    atlases.update(load_atlases(config['SIMULATION_ATLAS_DIR']))
+
+
+def lookup_atlas(model_cls, initial_parameters, amps):
+    for atlas in atlases.values():
+        if atlas.matches(model_cls, initial_parameters):
+            return atlas.get(amps)
+    return None
+
+
+def simulate(model_cls, initial_parameters, amps):
+    """Return the simulation result for a model and a normalized current.
+
+    Currents covered by a precomputed atlas are served straight from the memory map;
+    anything else is solved live and kept in the LRU cache."""
+    result = lookup_atlas(model_cls, initial_parameters, amps)
+    if result is not None:
+        return result
+    key = cache_key(model_cls, initial_parameters, amps)
+    return cache.get_or_compute(key, lambda: solve(model_cls, initial_parameters, amps))
+
+
+def cached_result(model_cls, initial_parameters, amps):
+    """Return the result if it is in the atlas or the cache, without solving."""
+    result = lookup_atlas(model_cls, initial_parameters, amps)
+    if result is None:
+        result = cache.get(cache_key(model_cls, initial_parameters, amps))
+    return result
+
+
+def submit_simulation(model_cls, initial_parameters, amps):
+    """Queue a solve on the background job queue and return the job id.
+
+    Identical pending solves share a job, and the finished result is added to the cache."""
+    key = cache_key(model_cls, initial_parameters, amps)
+    return jobs.queue.submit(solve, model_cls, initial_parameters, amps, kind=model_cls.__name__, key=key,
+                             on_result=lambda result: cache.put(key, freeze_result(result)))
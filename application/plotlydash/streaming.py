@@ -0,0 +1,65 @@
+"""Simulations solved window by window, so the page can draw them while they run.
+
+The page submits a stream job to the shared queue. The job runs on the job executor like
+any other solve: it solves the run in fixed time windows and writes each window's voltage
+and electrode potentials next to its status file as it finishes. The page's usual job poll
+returns the windows finished since its last poll, which the page appends to its live
+graphs, and once the job is done it renders the full results as for any other job."""
+import json
+import os
+import tempfile
+
+from flask import current_app
+
+from . import jobs, simulation
+
+
+def window_path(directory, job_id, index):
+    return os.path.join(directory, f'{job_id}.window{index}.json')
+
+
+def window_payload(window, positive, negative):
+    return {
+        'time': window.time.tolist(),
+        'voltage': window.voltage.tolist(),
+        'potential_time': window.internal[:, 0].tolist(),
+        'p_pot': window.internal[:, positive].tolist(),
+        'n_pot': window.internal[:, negative].tolist(),
+    }
+
+
+def solve_job(directory, job_id, name, amps, n_windows):
+    """Solve a stream job window by window on the job executor, writing each window for the relay."""
+    queue = jobs.JobQueue(directory)
+    model_cls, initial_parameters = simulation.MODELS[name]
+    positive, negative = simulation.potential_columns(model_cls(initial_parameters=initial_parameters))
+    windows = []
+    for window in simulation.solve_windows(model_cls, initial_parameters, amps, windows=n_windows):
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(window_payload(window, positive, negative), f)
+        os.replace(tmp, window_path(directory, job_id, len(windows)))
+        windows.append(window)
+        if not queue.update(job_id, progress=min(len(windows) / n_windows, 0.95), windows=len(windows)):
+            raise RuntimeError('timed out')
+    return simulation.assemble_windows(windows)
+
+
+def submit(name, amps):
+    """Queue a stream job for a model and a normalized current, and return its id. Raises jobs.QueueFull."""
+    model_cls, initial_parameters = simulation.MODELS[name]
+    n_windows = current_app.config.get('SIMULATION_STREAM_WINDOWS', 20)
+    # the windows are on a different time grid than solve()'s, so the result is kept out of the
+    # simulation cache, and only an identical stream shares a pending job
+    key = simulation.cache_key(model_cls, initial_parameters, amps) + ('windows', n_windows)
+    return jobs.queue.submit(solve_job, name, amps, n_windows, kind=model_cls.__name__, key=key, progress=True,
+                             model=name, amps=amps)
+
+
+def read_windows(job_id, start, stop):
+    """The payloads of windows start to stop - 1 of a stream job."""
+    windows = []
+    for index in range(start, stop):
+        with open(window_path(jobs.queue.directory, job_id, index)) as f:
+            windows.append(json.load(f))
+    return windows
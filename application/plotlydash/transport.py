@@ -0,0 +1,34 @@
+"""Serialization of simulation payloads for the hidden data divs.
+
+By default arrays are written as nested JSON lists. With SIMULATION_BINARY_TRANSPORT
+enabled they are written as base64 float32 buffers with shape metadata instead, which
+static/js/simulation.js decodes once per run into typed arrays."""
+import base64
+import json
+
+import numpy as np
+from flask import current_app
+
+
+def encode_array(values):
+    values = np.ascontiguousarray(values, dtype='<f4')
+    return {
+        '__ndarray__': base64.b64encode(values.tobytes()).decode('ascii'),
+        'dtype': 'float32',
+        'shape': list(values.shape),
+    }
+
+
+def _encode(obj, binary):
+    if isinstance(obj, dict):
+        return {key: _encode(value, binary) for key, value in obj.items()}
+    if isinstance(obj, np.ndarray):
+        return encode_array(obj) if binary else obj.tolist()
+    return obj
+
+
+def dumps(payload, binary=None):
+    """Serialize a payload of nested dicts and numpy arrays for a data div."""
+    if binary is None:
+        binary = current_app.config.get('SIMULATION_BINARY_TRANSPORT', False)
+    return json.dumps(_encode(payload, binary))
@@ -0,0 +1,235 @@
+"""Profiling of single requests on demand, and of a sample of all requests.
+
+With PROFILE_ENABLED set, a request carrying the header ``X-Profile: <PROFILE_SECRET>`` runs
+under a profiler and its profile is written to PROFILE_DIR, named after the time, the path,
+the Dash callback and its parameters, e.g.
+``20240101-120000.123456-POST-dashapp-_dash-update-component-..spm-main-plots.children...-spm-current.value=4.collapsed``.
+The response carries the file's name in ``X-Profile-File``.
+
+PROFILER picks the profiler:
+
+- ``sampling`` (the default) samples the request thread's stack every PROFILE_INTERVAL
+  seconds from a background thread and writes collapsed stacks, one ``frame;frame;... count``
+  line per stack, which speedscope and flamegraph.pl read directly. It adds little overhead,
+  but the GIL limits how often a busy thread can be sampled.
+- ``cprofile`` traces every call with cProfile and writes a ``.prof`` for pstats or snakeviz.
+
+With PROFILE_SAMPLE_EVERY = N, one in every N requests is also sampled, and the stacks of
+all of them are added up in ``aggregate-<pid>.collapsed``, under a root frame for each route
+and callback; the files of several workers can simply be concatenated.
+
+Only the thread that handles the request is profiled: a P2D solve that runs as a background
+job shows up as the callback that submits or polls it, not as the solve itself."""
+import cProfile
+import hmac
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+
+from werkzeug.exceptions import HTTPException
+
+DASH_UPDATE = '_dash-update-component'
+PROFILERS = ('sampling', 'cprofile')
+
+
+@lru_cache(maxsize=None)
+def short_path(filename):
+    """filename relative to the longest sys.path entry that contains it."""
+    for root in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(root + os.sep):
+            return filename[len(root) + 1:]
+    return filename
+
+
+def collapse(frame):
+    """The stack of frame as one collapsed-stack line, outermost call first."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({short_path(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """Samples the stack of one thread every interval from a background thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def write_collapsed(path, stacks):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    os.replace(tmp, path)
+
+
+def slug(text, limit=60):
+    return re.sub(r'[^A-Za-z0-9_.=+-]+', '-', text).strip('-')[:limit]
+
+
+def callback_details(body):
+    """The callback id and the scalar input and state values of a Dash callback request body."""
+    try:
+        body = json.loads(body)
+    except ValueError:
+        return None, []
+    params = []
+    for item in body.get('inputs', []) + body.get('state', []):
+        if isinstance(item, dict) and isinstance(item.get('value'), (str, int, float)):
+            params.append(f'{item.get("id")}.{item.get("property")}={item["value"]}')
+    return body.get('output'), params
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that profiles the requests asking for it, and one in every sample_every."""
+
+    def __init__(self, app, directory, secret=None, header='X-Profile', profiler='sampling', interval=0.005,
+                 sample_every=0):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self.directory = directory
+        self.secret = secret
+        self.environ_key = 'HTTP_' + header.upper().replace('-', '_')
+        self.profiler = profiler
+        self.interval = interval
+        self.sample_every = sample_every
+        self.aggregate = Counter()
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def requested(self, environ):
+        token = environ.get(self.environ_key)
+        if not self.secret or token is None:
+            return False
+        # WSGI headers are latin-1 strings, and compare_digest only takes ASCII ones, so compare bytes
+        return hmac.compare_digest(token.encode('latin-1'), self.secret.encode('utf-8'))
+
+    def sampled(self):
+        return self.sample_every > 0 and next(self._counter) % self.sample_every == 0
+
+    def route(self, environ):
+        """The URL rule the request matches, or its path if it belongs to no rule of the app."""
+        try:
+            rule, _ = self.app.url_map.bind_to_environ(environ).match(return_rule=True)
+            return rule.rule
+        except HTTPException:
+            return environ.get('PATH_INFO', '/')
+
+    def details(self, environ):
+        """The Dash callback and the parameters of a request, reading its body if it is a callback's."""
+        params = [environ['QUERY_STRING']] if environ.get('QUERY_STRING') else []
+        if not environ.get('PATH_INFO', '').endswith(DASH_UPDATE):
+            return None, params
+        body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        # put the body back for the app
+        environ['wsgi.input'] = io.BytesIO(body)
+        callback, callback_params = callback_details(body)
+        return callback, params + callback_params
+
+    def filename(self, environ, callback, params, ext):
+        parts = [datetime.now().strftime('%Y%m%d-%H%M%S.%f'), environ.get('REQUEST_METHOD', 'GET'),
+                 slug(environ.get('PATH_INFO', '/'))]
+        if callback:
+            parts.append(slug(callback))
+        parts.extend(slug(param, 40) for param in params)
+        return '-'.join(part for part in parts if part)[:200] + ext
+
+    def __call__(self, environ, start_response):
+        requested = self.requested(environ)
+        sampled = self.sampled()
+        if not requested and not sampled:
+            return self.wsgi_app(environ, start_response)
+        return self.profile(environ, start_response, requested, sampled)
+
+    def profile(self, environ, start_response, requested, sampled):
+        callback, params = self.details(environ)
+        use_cprofile = requested and self.profiler == 'cprofile'
+        name = self.filename(environ, callback, params, '.prof' if use_cprofile else '.collapsed') if requested else None
+        root = f'{environ.get("REQUEST_METHOD", "GET")} {self.route(environ)}' + (f' {callback}' if callback else '')
+
+        def profiled_start_response(status, headers, exc_info=None):
+            if name is not None:
+                headers = headers + [('X-Profile-File', name)]
+            return start_response(status, headers, exc_info)
+
+        if use_cprofile:
+            profile = cProfile.Profile()
+            profile.enable()
+        else:
+            profile = Sampler(threading.get_ident(), self.interval)
+            profile.start()
+        iterable = None
+        try:
+            # iterate here, so a streamed response is profiled until it is sent
+            iterable = self.wsgi_app(environ, profiled_start_response)
+            yield from iterable
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            if use_cprofile:
+                profile.disable()
+                profile.dump_stats(os.path.join(self.directory, name))
+            else:
+                profile.stop()
+                if requested:
+                    write_collapsed(os.path.join(self.directory, name), profile.stacks)
+                if sampled:
+                    self.add_to_aggregate(root, profile.stacks)
+
+    def add_to_aggregate(self, root, stacks):
+        with self._lock:
+            for stack, count in stacks.items():
+                self.aggregate[f'{root};{stack}'] += count
+            write_collapsed(os.path.join(self.directory, f'aggregate-{os.getpid()}.collapsed'), self.aggregate)
+
+
+def init_app(app):
+    """Wrap app in the profiling middleware, if PROFILE_ENABLED. Install it last, around every other middleware."""
+    config = app.config
+    if not config.get('PROFILE_ENABLED', False):
+        return None
+    profiler = config.get('PROFILER', 'sampling')
+    if profiler not in PROFILERS:
+        raise ValueError(f'PROFILER must be one of {", ".join(PROFILERS)}, not {profiler!r}')
+    if not config.get('PROFILE_SECRET') and not config.get('PROFILE_SAMPLE_EVERY', 0):
+        app.logger.warning('PROFILE_ENABLED is set without PROFILE_SECRET or PROFILE_SAMPLE_EVERY, so nothing is profiled')
+    middleware = ProfilingMiddleware(
+        app,
+        config.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'profiles')),
+        secret=config.get('PROFILE_SECRET'),
+        header=config.get('PROFILE_HEADER', 'X-Profile'),
+        profiler=profiler,
+        interval=config.get('PROFILE_INTERVAL', 0.005),
+        sample_every=config.get('PROFILE_SAMPLE_EVERY', 0),
+    )
+    app.wsgi_app = middleware
+    return middleware
@@ -0,0 +1,83 @@
+"""On-disk cache of the HTML that markdown renders for each FlatPages body.
+
+Entries are keyed by a hash of the markdown source together with the extension list and
+the markdown and pygments versions, so a changed article or upgraded highlighter simply
+misses. The cache is a directory of files written atomically, which lets every gunicorn
+worker share it and keeps it across restarts."""
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import markdown
+import pygments
+
+MARKDOWN_EXTENSIONS = ["codehilite", "fenced_code", "tables", "mdx_math"]
+
+
+def markdown_to_html(text):
+    return markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS)
+
+
+class RenderCache:
+    """Rendered HTML stored as ``<directory>/<sha256>.html``."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        config = json.dumps([MARKDOWN_EXTENSIONS, markdown.__version__, pygments.__version__])
+        self._salt = hashlib.sha256(config.encode()).digest()
+
+    def key(self, text):
+        return hashlib.sha256(self._salt + text.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.html")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key, html):
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a private temp file first, so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(tmp, self._path(key))
+
+    def render(self, text):
+        """Return the HTML for a markdown text, rendering and storing it on a miss."""
+        key = self.key(text)
+        html = self.get(key)
+        if html is None:
+            html = markdown_to_html(text)
+            self.put(key, html)
+        return html
+
+    def warm(self, texts, max_workers=None):
+        """Render every text that is not cached yet on a process pool. Returns the number rendered."""
+        missing = {}
+        for text in texts:
+            key = self.key(text)
+            if key not in missing and not os.path.exists(self._path(key)):
+                missing[key] = text
+        if not missing:
+            return 0
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            for key, html in zip(missing, pool.map(markdown_to_html, missing.values())):
+                self.put(key, html)
+        return len(missing)
+
+
+cache = None
+
+
+def configure(config):
+    """Open the render cache in MARKDOWN_CACHE_DIR."""
+    global cache
+    cache = RenderCache(config.get("MARKDOWN_CACHE_DIR", os.path.join(tempfile.gettempdir(), "flatpages-html")))
+    return cache
@@ -0,0 +1,121 @@
+"""Conditional GET and a bounded LRU of rendered responses for the blog routes.
+
+A cached view supplies a cheap signature for each request, built from page mtimes and
+metadata rather than from the rendered body. The ETag is a hash of that signature and
+the view arguments, so an If-None-Match revalidation is answered with a 304 before any
+template is rendered, and a miss renders once and keeps the body for the next request."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+
+class ResponseCache:
+    """LRU of (body, mimetype) keyed by ETag, bounded by entry count and total body bytes."""
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, mimetype):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, mimetype)
+            self.nbytes += len(body)
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+cache = ResponseCache()
+_template_version = None
+_asset_version = None
+
+
+def configure(config):
+    cache.max_entries = config.get("RESPONSE_CACHE_ENTRIES", cache.max_entries)
+    cache.max_bytes = config.get("RESPONSE_CACHE_BYTES", cache.max_bytes)
+
+
+def template_version():
+    """Latest template mtime, so editing a template changes every ETag. Re-read in debug mode only."""
+    global _template_version
+    if _template_version is None or current_app.debug:
+        folder = os.path.join(current_app.root_path, current_app.template_folder)
+        _template_version = max((entry.stat().st_mtime for entry in os.scandir(folder) if entry.is_file()), default=0)
+    return _template_version
+
+
+def asset_version():
+    """Versions of the flask-assets bundles, whose fingerprinted URLs are in every page. Re-read in debug mode only."""
+    global _asset_version
+    if _asset_version is None or current_app.debug:
+        assets = getattr(current_app.jinja_env, "assets_environment", None)
+        _asset_version = tuple(bundle.get_version() for bundle in assets) if assets is not None else ()
+    return _asset_version
+
+
+def cached(signature):
+    """Decorate a view with ETag / Last-Modified validators and response caching.
+
+    signature(**view_args) returns (token, last_modified), where token changes whenever the
+    rendered response would and last_modified is a POSIX timestamp or None. It returns None
+    for requests that should go straight to the view, such as a missing page. Only 200
+    responses are cached."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not current_app.config.get("RESPONSE_CACHE", True):
+                return view(**kwargs)
+            sig = signature(**kwargs)
+            if sig is None:
+                return view(**kwargs)
+            token, last_modified = sig
+            key = repr((request.endpoint, sorted(kwargs.items()), token, template_version(), asset_version()))
+            etag = hashlib.sha1(key.encode()).hexdigest()
+
+            entry = cache.get(etag)
+            # weak comparison, since a compressed response carries the ETag as weak
+            if entry is None and not request.if_none_match.contains_weak(etag):
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+                cache.put(etag, response.get_data(), response.mimetype)
+            else:
+                # a revalidation is answered from the ETag alone, even if the body was evicted
+                body, mimetype = entry if entry is not None else (b"", None)
+                response = current_app.response_class(body, mimetype=mimetype)
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
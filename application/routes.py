@@ -1,18 +1,42 @@
-import pygments, markdown, os
-from flask import Flask, flash, redirect, render_template, render_template_string, request, url_for, send_from_directory
+import pygments, markdown, os, json
+from flask import Flask, Response, abort, flash, jsonify, redirect, render_template, render_template_string, request, url_for, stream_with_context
 from flask import current_app as app
 from flask_flatpages import FlatPages, pygmented_markdown, pygments_style_defs
 from flask_mail import Mail, Message
 # from flask_simple_captcha import CAPTCHA
 from flask_recaptcha import ReCaptcha
 
-from .forms.paginate import Paginate as Paginate
 from .forms.forms import ContactForm as ContactForm
+from . import images, mail_spool
+from .indexes import PageVersions, PostIndex, TagIndex
+from .search import SearchIndex
+from .response_cache import cached
 
 email_addr = os.environ.get('EMAIL_ACC', '')
 pages = FlatPages(app)
 mail = Mail(app)
 recaptcha = ReCaptcha(app)
+post_index = PostIndex(pages, app.config["PAGES_NUMBER_PER_PAGE"])
+tag_index = TagIndex(pages)
+page_versions = PageVersions(pages)
+search_index = SearchIndex(pages)
+
+
+def site_signature(**kwargs):
+    # listings and post footers (tag counts) depend on every page, so any page change invalidates them
+    return page_versions.version, page_versions.last_modified
+
+
+def page_signature(path):
+    mtime = page_versions.mtime(path)
+    if mtime is None:
+        return None
+    return page_versions.version, mtime
+
+
+@app.context_processor
+def inject_tag_index():
+    return {"tag_index": tag_index}
 
 
 # 404
@@ -22,41 +46,44 @@ def page_not_found(e):
 
 
 @app.route('/pygments.css')
+@cached(lambda: (("monokai", pygments.__version__), None))
 def pygments_css():
     return pygments_style_defs("monokai"), 200, {"Content-Type":"text/css"}
 
 
 @app.route("/")
+@cached(site_signature)
 def index(num = 0):
-    posts = [p for p in pages if "date" in p.meta]
-    sorted_pages=sorted(posts, reverse=True, key=lambda page: page.meta["date"])
-    ppaginate=Paginate(app.config["PAGES_NUMBER_PER_PAGE"],sorted_pages)
-    if (num >= ppaginate.get_total_number()):
+    if (num >= post_index.get_total_number()):
         return redirect(url_for("index_extend"))
 
-    return render_template("index.html",num=num,pages=ppaginate.get_number_pages(num),config=app.config,current_number=num,total_num=ppaginate.get_total_number()- 1)
+    return render_template("index.html",num=num,pages=post_index.get_number_pages(num),config=app.config,current_number=num,total_num=post_index.get_total_number()- 1)
 
 
 @app.route("/index/<string:num>.html")
+@cached(site_signature)
 def index_extend(num):
     num=int(num)
-    posts = [p for p in pages if "date" in p.meta]
-    sorted_pages=sorted(posts, reverse=True, key=lambda page: page.meta["date"])
-    ppaginate=Paginate(app.config["PAGES_NUMBER_PER_PAGE"],sorted_pages)
-    if (num >= ppaginate.get_total_number()):
+    total = post_index.get_total_number()
+    if (num >= total):
         num = 0
+    elif num < 0:
+        # counts back from the last page, like the list index it used to be
+        num += total
+        if num < 0:
+            abort(404)
 
     return render_template("index.html",
                            num=num,
-                           pages=ppaginate.get_number_pages(num),
+                           pages=post_index.get_number_pages(num),
                            config=app.config,
                            current_number=num,
-                           total_num=ppaginate.get_total_number() - 1)
+                           total_num=post_index.get_total_number() - 1)
 
 
 @app.route("/<path:path>/")
+@cached(page_signature)
 def staticpage(path):
-    print('path', path)
     p = pages.get_or_404(path)
     staticpage = p if "static" in p.meta else None
     if page == None:
@@ -67,18 +94,42 @@ def staticpage(path):
 
 @app.route('/status')
 def status():
-    return 200
+    return jsonify(status='ok')
+
+
+@app.route('/api/simulate', methods=['POST'])
+def api_simulate():
+    """Solve a list of currents in parallel and stream one NDJSON record per current as each finishes.
+
+    The body is {"model": "SPM" | "SPM-SEI" | "P2D", "currents": [...], "internal": false}."""
+    # imported here so the blog can run without loading the solvers (see plotlydash.mount)
+    from .plotlydash import batch, jobs
+    try:
+        name, currents, internal = batch.parse_request(request.get_json(silent=True))
+    except batch.BatchError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        records = batch.run(name, currents, internal)
+    except jobs.QueueFull:
+        return jsonify(error='the simulation queue is full, try again shortly'), 503, {'Retry-After': '10'}
+
+    def generate():
+        for record in records:
+            yield json.dumps(record) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 @app.route('/img/<path:filename>/')
 def serve_static(filename):
-    print('filename', filename)
-    root_dir = os.path.dirname(os.path.realpath(__file__))
-    print(root_dir)
-    return send_from_directory(os.path.join(root_dir, 'pages', 'img'), filename)
+    response = images.serve(filename)
+    if response is None:
+        abort(404)
+    return response
 
 
 @app.route("/articles/<path:path>/")
+@cached(page_signature)
 def page(path):
     p = pages.get_or_404(path)
     page = p if "date" in p.meta else None
@@ -88,9 +139,32 @@ def page(path):
 
 
 @app.route("/tag/<string:tag>/")
+@cached(site_signature)
 def tag(tag):
-    tagged = [p for p in pages if tag in p.meta.get("tags", [])]
-    return render_template("tags.html", pages=tagged, tag=tag)
+    # /tag/a+b/ lists the pages tagged with both a and b
+    tags = [t for t in tag.split("+") if t]
+    tagged = tag_index.get(tags[0]) if len(tags) == 1 else tag_index.intersection(tags)
+    return render_template("tags.html", pages=tagged, tag=" + ".join(tags))
+
+
+@app.route("/search")
+def search():
+    query = request.args.get("q", "").strip()
+    results = search_index.search(query, limit=app.config.get("SEARCH_RESULTS", 20)) if query else []
+    return render_template("search.html", query=query,
+                           results=[(page, search_index.snippet(page, query)) for page, _ in results])
+
+
+@app.route("/api/search")
+def api_search():
+    """Search results as JSON for a live search box; the last word of q is matched as a prefix."""
+    query = request.args.get("q", "")
+    limit = min(max(request.args.get("limit", 10, type=int), 1), app.config.get("SEARCH_RESULTS", 20))
+    results = search_index.search(query, limit=limit)
+    return jsonify(query=query, results=[
+        {"title": page.meta.get("title"), "url": url_for("page", path=page.path), "date": str(page.meta["date"]),
+         "score": round(score, 3)}
+        for page, score in results])
 
 
 @app.route("/contact", methods=("GET", "POST"))
@@ -111,7 +185,8 @@ def contact():
                 From: %s <%s>,
                 %s
                 """ % (form.name.data, form.email.data, form.message.data)
-                mail.send(msg)
+                # sent in the background, so a slow mail server does not hold up the worker
+                mail_spool.spool.enqueue(msg)
                 flash("Message sent.")
                 return redirect( url_for("contact") )
 
@@ -0,0 +1,206 @@
+"""In-memory full-text search over the articles, ranked with BM25.
+
+The index is built from each article's title, description, tags and rendered text whenever
+FlatPages loads its pages. Every term maps to compact postings: the ids of the articles it
+occurs in, a field-weighted term frequency per article, and the token positions, which
+answer quoted phrase queries. The vocabulary is kept sorted so the last word of a query
+can be matched as a prefix with two bisections, for a search box that queries as you type."""
+import bisect
+import html
+import math
+import re
+from array import array
+
+from .indexes import FlatPagesIndex, page_tags
+
+TOKEN = re.compile(r"\w+")
+TAG = re.compile(r"<[^>]+>")
+PHRASE = re.compile(r'"([^"]*)"')
+
+# a match in the title counts as much as this many matches in the body
+FIELD_WEIGHTS = (("title", 4), ("descr", 2), ("tags", 3), ("body", 1))
+# position gap between fields, so a phrase never matches across the end of one field and the start of the next
+FIELD_GAP = 16
+# prefix matches considered per query, most frequent terms first
+MAX_EXPANSIONS = 32
+SNIPPET_CHARS = 160
+
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def plain_text(markup):
+    return html.unescape(TAG.sub(" ", markup))
+
+
+def page_text(page):
+    try:
+        return plain_text(page.html)
+    except Exception:
+        # a page whose template needs a request cannot be rendered while the index is built,
+        # so its markdown source is indexed instead
+        return page.body
+
+
+def page_fields(page):
+    return {
+        "title": page.meta.get("title") or "",
+        "descr": page.meta.get("descr") or "",
+        "tags": " ".join(page_tags(page)),
+        "body": page_text(page),
+    }
+
+
+class Postings:
+    __slots__ = ("docs", "tfs", "positions", "idf")
+
+    def __init__(self):
+        self.docs = array("I")
+        self.tfs = array("f")
+        self.positions = []
+        self.idf = 0.0
+
+
+class SearchIndex(FlatPagesIndex):
+    """Positional inverted index over the dated articles, queried with BM25 and prefix matching."""
+
+    def __init__(self, pages):
+        super().__init__(pages)
+        self._pages = []
+        self._docs = {}
+        self._texts = []
+        self._norms = array("f")
+        self._postings = {}
+        self._vocabulary = []
+
+    def _build(self, source):
+        pages = [p for p in source.values() if "date" in p.meta]
+        postings = {}
+        lengths = []
+        texts = []
+        for doc, page in enumerate(pages):
+            fields = page_fields(page)
+            texts.append(" ".join(fields["body"].split()))
+            position = 0
+            length = 0
+            weighted = {}
+            positions = {}
+            for field, weight in FIELD_WEIGHTS:
+                tokens = tokenize(fields[field])
+                for offset, token in enumerate(tokens):
+                    weighted[token] = weighted.get(token, 0) + weight
+                    positions.setdefault(token, array("I")).append(position + offset)
+                position += len(tokens) + FIELD_GAP
+                length += weight * len(tokens)
+            lengths.append(length)
+            for token, tf in weighted.items():
+                entry = postings.get(token)
+                if entry is None:
+                    entry = postings[token] = Postings()
+                entry.docs.append(doc)
+                entry.tfs.append(tf)
+                entry.positions.append(positions[token])
+
+        n = len(pages)
+        average = sum(lengths) / n if n else 0
+        for entry in postings.values():
+            df = len(entry.docs)
+            entry.idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        self._pages = pages
+        self._docs = {id(page): doc for doc, page in enumerate(pages)}
+        self._texts = texts
+        # the length normalisation of BM25's denominator, which depends only on the document
+        self._norms = array("f", (K1 * (1 - B + B * length / average) if average else K1 for length in lengths))
+        self._postings = postings
+        self._vocabulary = sorted(postings)
+
+    def expand(self, prefix):
+        """Indexed terms starting with prefix, most frequent first, at most MAX_EXPANSIONS of them."""
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        stop = bisect.bisect_left(vocabulary, prefix + "\uffff", start)
+        terms = vocabulary[start:stop]
+        if len(terms) > MAX_EXPANSIONS:
+            terms = sorted(terms, key=lambda term: -len(self._postings[term].docs))[:MAX_EXPANSIONS]
+        return terms
+
+    def _score(self, scores, term):
+        entry = self._postings.get(term)
+        if entry is None:
+            return
+        norms = self._norms
+        for doc, tf in zip(entry.docs, entry.tfs):
+            scores[doc] = scores.get(doc, 0.0) + entry.idf * tf * (K1 + 1) / (tf + norms[doc])
+
+    def _phrase_docs(self, terms):
+        """Ids of the articles containing terms as consecutive tokens."""
+        entries = [self._postings.get(term) for term in terms]
+        if not entries or any(entry is None for entry in entries):
+            return set()
+        matches = None
+        for offset, entry in enumerate(entries):
+            starts = {doc: {p - offset for p in positions} for doc, positions in zip(entry.docs, entry.positions)
+                      if matches is None or doc in matches}
+            if matches is not None:
+                starts = {doc: matches[doc] & found for doc, found in starts.items()}
+            matches = {doc: found for doc, found in starts.items() if found}
+            if not matches:
+                return set()
+        return set(matches)
+
+    def search(self, query, limit=20, prefix=True):
+        """(page, score) pairs for query, best first.
+
+        Every word must occur in an article for it to match. With prefix, the last word also
+        matches any longer term, unless it ends with a space. Quoted words must occur as a phrase."""
+        self.refresh()
+        phrases = [tokenize(phrase) for phrase in PHRASE.findall(query)]
+        words = tokenize(PHRASE.sub(" ", query))
+        partial = prefix and bool(words) and not query[-1:].isspace() and not query.rstrip().endswith('"')
+
+        scores = {}
+        required = []
+        for i, word in enumerate(words):
+            terms = self.expand(word) if partial and i == len(words) - 1 else [word]
+            # an article scores by its best matching expansion, so many word forms do not add up
+            word_scores = {}
+            for term in terms:
+                term_scores = {}
+                self._score(term_scores, term)
+                for doc, score in term_scores.items():
+                    if score > word_scores.get(doc, 0.0):
+                        word_scores[doc] = score
+            required.append(set(word_scores))
+            for doc, score in word_scores.items():
+                scores[doc] = scores.get(doc, 0.0) + score
+        for phrase in phrases:
+            if not phrase:
+                continue
+            for term in phrase:
+                self._score(scores, term)
+            required.append(self._phrase_docs(phrase))
+        if not required:
+            return []
+
+        matched = set.intersection(*required)
+        ranked = sorted(matched, key=lambda doc: (-scores[doc], self._pages[doc].path))[:limit]
+        return [(self._pages[doc], scores[doc]) for doc in ranked]
+
+    def snippet(self, page, query, length=SNIPPET_CHARS):
+        """A stretch of the article's text around the first occurrence of a query word."""
+        self.refresh()
+        doc = self._docs.get(id(page))
+        if doc is None:
+            return ""
+        text = self._texts[doc]
+        lowered = text.lower()
+        found = [i for i in (lowered.find(word) for word in tokenize(query)) if i >= 0]
+        start = max(min(found, default=0) - length // 4, 0)
+        if start:
+            start = text.find(" ", start) + 1
+        snippet = text[start:start + length].rsplit(" ", 1)[0] if len(text) > start + length else text[start:]
+        return ("… " if start else "") + snippet + (" …" if start + length < len(text) else "")
@@ -0,0 +1,47 @@
+"""Per-phase timing and memory of application startup."""
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+def rss():
+    """Resident set size of this process in bytes; the peak if the current size is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StartupTimer:
+    """Records how long each named startup phase takes and how much it grew RSS, in the order they ran."""
+
+    def __init__(self, title='Startup'):
+        self.title = title
+        self.phases = []
+        self.started = time.perf_counter()
+        self.rss_started = rss()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        rss_start = rss()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start, rss() - rss_start))
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def report(self):
+        mb = 1024 * 1024
+        lines = [f'{name:<20} {seconds * 1000:8.1f} ms {grown / mb:+8.1f} MB' for name, seconds, grown in self.phases]
+        lines.append(f'{"total":<20} {self.total * 1000:8.1f} ms {(rss() - self.rss_started) / mb:+8.1f} MB')
+        lines.append(f'{"rss":<20} {rss() / mb:20.1f} MB')
+        return f'{self.title} timing:\n' + '\n'.join(lines)
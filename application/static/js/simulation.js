@@ -0,0 +1,159 @@
+// Clientside callbacks for scrubbing through the simulation pages.
+//
+// The hidden data divs hold either plain JSON or JSON with base64 float32 buffers
+// ({"__ndarray__": ..., "shape": [...]}). Each payload is parsed and decoded once and
+// cached, so dragging the time slider only indexes into arrays that already exist.
+(function() {
+    const MAX_CACHED = 8;
+    const cache = [];
+
+    function decodeArray(obj) {
+        const bytes = atob(obj.__ndarray__);
+        const buffer = new ArrayBuffer(bytes.length);
+        const view = new Uint8Array(buffer);
+        for (let i = 0; i < bytes.length; i++) {
+            view[i] = bytes.charCodeAt(i);
+        }
+        const flat = new Float32Array(buffer);
+        if (obj.shape.length < 2) {
+            return flat;
+        }
+        // rows are zero-copy views into the flat buffer
+        const width = obj.shape[1];
+        const rows = [];
+        for (let i = 0; i < obj.shape[0]; i++) {
+            rows.push(flat.subarray(i * width, (i + 1) * width));
+        }
+        return rows;
+    }
+
+    function decodeValue(value) {
+        if (value === null || typeof value !== 'object' || Array.isArray(value)) {
+            return value;
+        }
+        if (value.__ndarray__ !== undefined) {
+            return decodeArray(value);
+        }
+        const out = {};
+        for (const key of Object.keys(value)) {
+            out[key] = decodeValue(value[key]);
+        }
+        return out;
+    }
+
+    function load(data) {
+        for (const entry of cache) {
+            if (entry.raw === data) {
+                return entry.value;
+            }
+        }
+        const value = decodeValue(JSON.parse(data));
+        cache.unshift({raw: data, value: value});
+        if (cache.length > MAX_CACHED) {
+            cache.pop();
+        }
+        return value;
+    }
+
+    function toArray(values) {
+        return values === undefined ? [] : Array.prototype.slice.call(values);
+    }
+
+    function particleProfiles(time, data, key, xKey) {
+        const _data = load(data);
+        const profiles = _data[key];
+        const x = toArray(_data[xKey]);
+        const xs = [];
+        const ys = [];
+        const indices = [];
+        let count = 0;
+        for (const value of Object.values(profiles)) {
+            xs.push(x);
+            ys.push(toArray(value[time]));
+            indices.push(count);
+            count++;
+        }
+        return [{'x': xs, 'y': ys}, indices, x.length];
+    }
+
+    // Live graphs for a simulation solved window by window. Each poll of the job brings the
+    // windows solved since the last one, which extend the voltage and potential traces.
+    const pending = [];
+    let timer = null;
+
+    function graphDiv(id) {
+        const el = document.getElementById(id);
+        if (el === null || el.classList.contains('js-plotly-plot')) {
+            return el;
+        }
+        return el.querySelector('.js-plotly-plot');
+    }
+
+    function appendWindows(windows, voltageId, potentialId) {
+        if (!windows) {
+            // a new run, or the results replaced the live graphs
+            pending.length = 0;
+            return '';
+        }
+        pending.push(...windows);
+
+        // the graphs are created by the callback that submits the job, so wait for plotly to draw them
+        function flush() {
+            timer = null;
+            const voltage = graphDiv(voltageId);
+            const potential = graphDiv(potentialId);
+            if (voltage === null || potential === null || !voltage.data || !potential.data) {
+                if (pending.length > 0) {
+                    timer = setTimeout(flush, 50);
+                }
+                return;
+            }
+            while (pending.length > 0) {
+                const w = pending.shift();
+                window.Plotly.extendTraces(voltage, {'x': [w.time], 'y': [w.voltage]}, [0]);
+                window.Plotly.extendTraces(potential, {'x': [w.potential_time, w.potential_time], 'y': [w.p_pot, w.n_pot]}, [0, 1]);
+            }
+        }
+
+        if (timer === null) {
+            flush();
+        }
+        return 'streaming';
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        simulation: {
+            // tuple is (dict of new data, target trace index, number of points to keep)
+            time_indicator: function(time, data) {
+                const _time = load(data)['voltage_data']['time'];
+                return [{'x': [[_time[time], _time[time]]], 'y': [[2, 4.2]]}, [1], 2];
+            },
+            potential_markers: function(time, data) {
+                const _data = load(data);
+                const _time = _data['voltage_data']['time'];
+                const pot = _data['internal_data']['p_pot'];
+                const npot = _data['internal_data']['n_pot'];
+                return [{'x': [[_time[time]], [_time[time]]], 'y': [[pot[time]], [npot[time]]]}, [1, 3], 1];
+            },
+            spm_positive: function(time, data) {
+                const _data = load(data)['internal_data'];
+                const _px = toArray(_data['p_x']);
+                return [{'x': [_px], 'y': [toArray(_data['positive'][time])]}, [1], _px.length];
+            },
+            spm_negative: function(time, data) {
+                const _data = load(data)['internal_data'];
+                const _nx = toArray(_data['n_x']);
+                return [{'x': [_nx], 'y': [toArray(_data['negative'][time])]}, [1], _nx.length];
+            },
+            p2d_positive: function(time, data) {
+                return particleProfiles(time, data, 'positive', 'p_x');
+            },
+            p2d_negative: function(time, data) {
+                return particleProfiles(time, data, 'negative', 'n_x');
+            },
+            p2d_stream: function(windows) {
+                return appendWindows(windows, 'p2d-live-voltage', 'p2d-live-potential');
+            }
+        }
+    });
+})();
@@ -0,0 +1,38 @@
+"""Gunicorn settings for the production image.
+
+The app is built once in the master (preload) and the simulation models are warmed up
+before the workers fork, so every worker starts with the imports, pages and solvers
+already loaded and shares those pages with the master copy-on-write."""
+import os
+import shutil
+import tempfile
+
+bind = ':8000'
+# set in the environment too, so each worker sizes its pool of solver processes to its share of the cores
+workers = int(os.environ.setdefault('WEB_CONCURRENCY', '3'))
+preload_app = True
+# a sync worker is busy for the whole of a long response, such as a batch on /api/simulate waiting
+# for its solves
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 180))
+
+os.environ.setdefault('STARTUP_WARMUP', '1')
+
+# every worker and simulation process writes its metrics here, for /metrics to add up; this runs
+# before the app is loaded, so the files of the previous run are cleared before anything records
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'prometheus-metrics'))
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    timer = server.app.wsgi().extensions.get('startup_timer')
+    if timer is not None:
+        server.log.info(timer.report())
+
+
+def post_fork(server, worker):
+    # threads do not survive the fork, so each worker starts its own mail sender
+    from application import mail_spool
+    if mail_spool.spool is not None:
+        mail_spool.spool.start()
+
@@ -0,0 +1,344 @@
+"""Load test of a running copy of the site with a mix of blog and simulation traffic.
+
+    python loadtest.py --serve --duration 60 --users 12
+    python loadtest.py --url http://localhost:8000 --mix article=50 --mix spm-run=0 -o results.json
+
+Each of --users simulated visitors picks an endpoint class by its weight in the mix, sends
+its request and waits --think seconds, until --duration runs out. The URLs are found by
+crawling the home page, the index pages and the articles first, so the run covers whatever
+the site serves. With the same --seed and --users the sequence of requests is the same.
+
+The report gives the throughput, the p50/p95/p99 latency and the error rate of each class.
+A P2D run is one click and then the polls the page makes every POLL_INTERVAL until the
+result is rendered; each poll counts as a p2d-poll request. With --serve the app is
+started under gunicorn with gunicorn.conf.py, as in production, and stopped afterwards."""
+import gzip
+import http.client
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import click
+
+DASH_UPDATE = '/dashapp/_dash-update-component'
+# dcc.Interval of the P2D page, in seconds
+POLL_INTERVAL = 0.5
+# slider ranges of the SPM and P2D pages, in amps
+CURRENT_RANGES = {'spm': (-10, 10), 'p2d': (-8, 10)}
+
+# relative weight of each endpoint class in the default mix
+MIX = {
+    'home': 15,
+    'index': 10,
+    'article': 30,
+    'tag': 10,
+    'image': 15,
+    'dash-layout': 8,
+    'dash-page': 6,
+    'spm-run': 4,
+    'p2d-run': 2,
+}
+
+LINKS = {
+    'article': re.compile(r'href="(/articles/[^"#?]+/)"'),
+    'tag': re.compile(r'href="(/tag/[^"#?]+/)"'),
+    'index': re.compile(r'href="(/index/\d+\.html)"'),
+    'image': re.compile(r'src="(/img/[^"]+)"'),
+}
+
+
+def percentile(values, q):
+    """The q-th percentile of values, by linear interpolation between the closest ranks."""
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+class Client:
+    """HTTP requests to one server, a new connection each, as gunicorn's sync workers close them anyway."""
+
+    def __init__(self, url, timeout=120):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        """Send a request and read the whole response, following redirects like a browser.
+
+        Returns (status, body), the status None on a network error."""
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        for _ in range(4):
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                content = response.read()
+            except (OSError, http.client.HTTPException):
+                return None, b''
+            finally:
+                connection.close()
+            location = response.getheader('Location')
+            if response.status not in (301, 302, 307, 308) or not location:
+                break
+            # image links without the trailing slash are redirected to the route
+            path = urlsplit(location).path
+        if response.getheader('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return response.status, content
+
+
+def crawl(client):
+    """URLs of each class linked from the home page, the index pages and the articles."""
+    found = {name: set() for name in LINKS}
+    visited = set()
+    queue = ['/']
+    while queue:
+        path = queue.pop()
+        if path in visited:
+            continue
+        visited.add(path)
+        status, body = client.request('GET', path)
+        if status != 200:
+            continue
+        html = body.decode('utf-8', 'replace')
+        for name, pattern in LINKS.items():
+            for url in pattern.findall(html):
+                found[name].add(url)
+                if name in ('article', 'index'):
+                    queue.append(url)
+    return {name: sorted(urls) for name, urls in found.items()}
+
+
+def dash_update(outputs, inputs, state, changed):
+    """Body of a _dash-update-component request; outputs, inputs and state are (id, property[, value]) tuples."""
+    multi = len(outputs) > 1
+    return {
+        'output': ('..' + '...'.join(f'{i}.{p}' for i, p in outputs) + '..') if multi else '.'.join(outputs[0]),
+        'outputs': [{'id': i, 'property': p} for i, p in outputs] if multi else {'id': outputs[0][0], 'property': outputs[0][1]},
+        'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+        'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+        'changedPropIds': changed,
+    }
+
+
+P2D_OUTPUTS = [('p2d-main-plots', 'children'), ('p2d-data-div', 'children'), ('p2d-data-internal-pos-div', 'children'),
+               ('p2d-data-internal-neg-div', 'children'), ('p2d-job', 'data'), ('p2d-poll', 'disabled'),
+               ('p2d-progress', 'children'), ('p2d-stream', 'data')]
+
+
+def p2d_request(amps, job, n_intervals, changed):
+    return dash_update(P2D_OUTPUTS,
+                       [('p2d-start-button', 'n_clicks', 1), ('p2d-poll', 'n_intervals', n_intervals)],
+                       [('p2d-current', 'value', amps), ('p2d-job', 'data', job)],
+                       [changed])
+
+
+class Stats:
+    """Latencies and errors of each endpoint class, shared by the visitors."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            self.errors[name] = self.errors.get(name, 0) + (not ok)
+
+    def report(self, elapsed):
+        classes = {}
+        for name in sorted(self.latencies):
+            latencies = self.latencies[name]
+            classes[name] = {
+                'requests': len(latencies),
+                'errors': self.errors[name],
+                'error_rate': self.errors[name] / len(latencies),
+                'throughput': len(latencies) / elapsed,
+                **{f'p{q}': percentile(latencies, q) for q in (50, 95, 99)},
+            }
+        every = [s for latencies in self.latencies.values() for s in latencies]
+        errors = sum(self.errors.values())
+        total = {
+            'requests': len(every),
+            'errors': errors,
+            'error_rate': errors / len(every) if every else 0.0,
+            'throughput': len(every) / elapsed,
+            **{f'p{q}': percentile(every, q) for q in (50, 95, 99)},
+        }
+        return {'elapsed': elapsed, 'classes': classes, 'total': total}
+
+
+class Visitor:
+    """One simulated visitor, sending a request of a class picked by weight at a time."""
+
+    def __init__(self, client, urls, mix, stats, rng, think):
+        self.client = client
+        self.urls = urls
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.stats = stats
+        self.rng = rng
+        self.think = think
+
+    def timed(self, name, method, path, body=None):
+        start = time.perf_counter()
+        status, content = self.client.request(method, path, body)
+        self.stats.record(name, time.perf_counter() - start, status is not None and status < 400)
+        return status, content
+
+    def current(self, page):
+        # the sliders step by 0.1A and the pages clamp small currents away from zero
+        low, high = CURRENT_RANGES[page]
+        amps = round(self.rng.uniform(low, high), 1)
+        return amps if abs(amps) >= 0.2 else 1.0
+
+    def visit(self, name):
+        if name in self.urls:
+            self.timed(name, 'GET', self.rng.choice(self.urls[name]))
+        elif name == 'home':
+            self.timed(name, 'GET', '/')
+        elif name == 'dash-layout':
+            self.timed(name, 'GET', self.rng.choice(['/dashapp/', '/dashapp/_dash-layout', '/dashapp/_dash-dependencies']))
+        elif name == 'dash-page':
+            # switching between the simulation pages runs the dashboard's url callback
+            pathname = self.rng.choice(['/dashapp/single-particle', '/dashapp/pseudo-two-dim', '/dashapp/'])
+            self.timed(name, 'POST', DASH_UPDATE, dash_update([('page-content', 'children')],
+                                                              [('url', 'pathname', pathname)], [], ['url.pathname']))
+        elif name == 'spm-run':
+            self.timed(name, 'POST', DASH_UPDATE, dash_update(
+                [('spm-main-plots', 'children'), ('spm-data-div', 'children')],
+                [('spm-start-button', 'n_clicks', 1)], [('spm-current', 'value', self.current('spm'))],
+                ['spm-start-button.n_clicks']))
+        elif name == 'p2d-run':
+            self.p2d_run()
+
+    def p2d_run(self):
+        amps = self.current('p2d')
+        status, content = self.timed('p2d-run', 'POST', DASH_UPDATE,
+                                     p2d_request(amps, None, None, 'p2d-start-button.n_clicks'))
+        n_intervals = 0
+        while status == 200:
+            response = json.loads(content)['response']
+            if response.get('p2d-poll', {}).get('disabled', True):
+                return
+            # a poll of a pending job leaves the job out of its response
+            if 'p2d-job' in response:
+                job = response['p2d-job'].get('data')
+            time.sleep(POLL_INTERVAL)
+            n_intervals += 1
+            status, content = self.timed('p2d-poll', 'POST', DASH_UPDATE,
+                                         p2d_request(amps, job, n_intervals, 'p2d-poll.n_intervals'))
+
+    def run(self, deadline):
+        while time.monotonic() < deadline:
+            self.visit(self.rng.choices(self.names, self.weights)[0])
+            if self.think:
+                time.sleep(self.rng.expovariate(1 / self.think))
+
+
+def run(client, urls, mix, users, duration, think, seed):
+    stats = Stats()
+    deadline = time.monotonic() + duration
+    visitors = [Visitor(client, urls, mix, stats, random.Random(seed + i), think) for i in range(users)]
+    threads = [threading.Thread(target=visitor.run, args=(deadline,), daemon=True) for visitor in visitors]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.report(time.perf_counter() - start)
+
+
+def serve(port):
+    """Start the app under gunicorn on port and wait until it answers /status."""
+    root = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                                '--bind', f'127.0.0.1:{port}', 'wsgi:app'], cwd=root)
+    client = Client(f'http://127.0.0.1:{port}', timeout=5)
+    for _ in range(600):
+        if process.poll() is not None:
+            raise click.ClickException(f'gunicorn exited with {process.returncode}')
+        if client.request('GET', '/status')[0] == 200:
+            return process
+        time.sleep(0.5)
+    process.terminate()
+    raise click.ClickException('gunicorn did not answer /status within 5 minutes')
+
+
+def parse_mix(pairs):
+    mix = dict(MIX)
+    for pair in pairs:
+        name, _, weight = pair.partition('=')
+        if name not in MIX:
+            raise click.BadParameter(f'unknown class {name!r}, expected one of {", ".join(MIX)}', param_hint='--mix')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise click.BadParameter(f'{pair!r} is not class=weight', param_hint='--mix')
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def format_report(report):
+    lines = [f'{"class":<12} {"requests":>9} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"errors":>7}']
+    rows = list(report['classes'].items()) + [('total', report['total'])]
+    for name, row in rows:
+        if not row['requests']:
+            continue
+        lines.append(f'{name:<12} {row["requests"]:>9} {row["throughput"]:>8.1f} {row["p50"] * 1000:>9.1f} '
+                     f'{row["p95"] * 1000:>9.1f} {row["p99"] * 1000:>9.1f} {row["error_rate"]:>7.1%}')
+    return '\n'.join(lines)
+
+
+@click.command()
+@click.option('--url', default='http://127.0.0.1:8000', show_default=True, help='Server to load.')
+@click.option('--serve', 'start', is_flag=True, help='Start the app under gunicorn at --url first.')
+@click.option('--users', default=8, show_default=True, help='Concurrent simulated visitors.')
+@click.option('--duration', default=60.0, show_default=True, help='Seconds to run for.')
+@click.option('--think', default=0.0, show_default=True, help='Mean pause of a visitor between requests, in seconds.')
+@click.option('--mix', 'mix_pairs', multiple=True, metavar='CLASS=WEIGHT',
+              help=f'Weight of an endpoint class, 0 to leave it out. Defaults: '
+                   f'{", ".join(f"{name}={weight}" for name, weight in MIX.items())}.')
+@click.option('--seed', default=0, show_default=True, help='Seed of the visitors\' random choices.')
+@click.option('--output', '-o', default=None, help='Also write the report as JSON to this file.')
+def main(url, start, users, duration, think, mix_pairs, seed, output):
+    """Load a running copy of the site with a mix of blog and simulation traffic."""
+    mix = parse_mix(mix_pairs)
+    client = Client(url)
+    process = serve(urlsplit(url).port or 80) if start else None
+    try:
+        urls = crawl(client)
+        for name in LINKS:
+            if name in mix and not urls[name]:
+                click.echo(f'no {name} links found, leaving {name} out of the mix')
+                del mix[name]
+        click.echo(f'{users} visitors for {duration:g}s, mix {mix}')
+        report = run(client, {name: found for name, found in urls.items() if name in mix}, mix, users, duration,
+                     think, seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    report.update(url=url, users=users, duration=duration, think=think, mix=mix, seed=seed)
+    click.echo(format_report(report))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()